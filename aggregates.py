@@ -0,0 +1,261 @@
+import json
+import heapq
+import hashlib
+from collections import defaultdict
+
+from store import StoreIndex
+
+
+def record_digest(record):
+    # Stable across processes (unlike hash()), so cache keys built from it
+    # can be shared by every worker
+    data = json.dumps(record, sort_keys=True, default=str).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def group_key(deposit, by):
+    date = deposit.get('date') or ''
+    if by == 'customer':
+        return deposit['customer_id']
+    return date[:7] if by == 'month' else date
+
+
+def deposit_totals(batches, by):
+    # {key: {'count', 'total'}} grouped by 'customer', 'month' or 'day', from
+    # iter_batches() output (see ledger.DepositLedger.totals for the
+    # vectorized version)
+    totals = defaultdict(lambda: [0, 0.0])
+    for batch in batches:
+        for deposit in batch:
+            bucket = totals[group_key(deposit, by)]
+            bucket[0] += 1
+            bucket[1] += deposit.get('amount') or 0
+    return {key: {'count': count, 'total': round(total, 2)} for key, (count, total) in sorted(totals.items())}
+
+
+class CustomerDepositIndex(StoreIndex):
+    # Per-customer view of the deposit ledger: deposit ids, running total,
+    # count, first/last date and a content digest that changes whenever any
+    # of the customer's deposits is added, edited or removed.
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._deposits = defaultdict(dict)
+        self._summaries = {}
+
+    def rebuild(self, records):
+        self._deposits = defaultdict(dict)
+        self._summaries = {}
+        for record in records:
+            self._deposits[record['customer_id']][record['id']] = self._entry(record)
+        for customer_id in self._deposits:
+            self._summarize(customer_id)
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._deposits[old['customer_id']].pop(old['id'], None)
+            self._summarize(old['customer_id'])
+        if record is None:
+            return
+        customer_id = record['customer_id']
+        entry = self._entry(record)
+        self._deposits[customer_id][record['id']] = entry
+        summary = self._summaries.get(customer_id)
+        if old is None and summary is not None:
+            # Plain inserts (the common case) update the summary in O(1)
+            date, amount, digest = entry
+            summary['deposit_ids'].append(record['id'])
+            summary['count'] += 1
+            summary['total'] += amount
+            summary['first_date'] = min(summary['first_date'], date)
+            summary['last_date'] = max(summary['last_date'], date)
+            summary['digest'] ^= digest
+        else:
+            self._summarize(customer_id)
+
+    def _entry(self, record):
+        return (record.get('date') or '', record.get('amount') or 0, record_digest(record))
+
+    def _summarize(self, customer_id):
+        entries = self._deposits.get(customer_id)
+        if not entries:
+            self._deposits.pop(customer_id, None)
+            self._summaries.pop(customer_id, None)
+            return
+        dates = [date for date, _, _ in entries.values()]
+        digest = 0
+        for _, _, entry_digest in entries.values():
+            digest ^= entry_digest
+        self._summaries[customer_id] = {
+            'deposit_ids': sorted(entries),
+            'count': len(entries),
+            'total': sum(amount for _, amount, _ in entries.values()),
+            'first_date': min(dates),
+            'last_date': max(dates),
+            'digest': digest,
+        }
+
+    def summary(self, customer_id):
+        self.sync()
+        with self._lock:
+            summary = self._summaries.get(customer_id)
+            if summary is None:
+                return {'deposit_ids': [], 'count': 0, 'total': 0, 'first_date': None,
+                        'last_date': None, 'digest': 0}
+            return dict(summary, deposit_ids=list(summary['deposit_ids']))
+
+    def has_deposits(self, customer_id):
+        self.sync()
+        with self._lock:
+            return customer_id in self._summaries
+
+    def report_key(self, customer_id):
+        summary = self.summary(customer_id)
+        return f"{summary['count']}-{summary['digest']:016x}"
+
+
+class RecentRecords(StoreIndex):
+    # Record count plus the newest `size` records (by id)
+
+    def __init__(self, store, size=5):
+        super().__init__(store)
+        self.size = size
+        self._count = 0
+        self._recent = []
+
+    def rebuild(self, records):
+        self._count = len(records)
+        self._recent = heapq.nlargest(self.size, records, key=lambda r: r['id'])
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._count -= 1
+            self._recent = [r for r in self._recent if r['id'] != old['id']]
+        if record is not None:
+            self._count += 1
+            self._recent = heapq.nlargest(self.size, self._recent + [record], key=lambda r: r['id'])
+        if len(self._recent) < min(self.size, self._count):
+            # A deleted record left a gap only the full data can fill
+            self.invalidate()
+
+    def count(self):
+        self.sync()
+        with self._lock:
+            return self._count
+
+    def recent(self):
+        self.sync()
+        with self._lock:
+            return [dict(r) for r in self._recent]
+
+
+class DepositRollups(StoreIndex):
+    # Deposit count and amount, overall and per day / per month (keyed by
+    # the deposit's YYYY-MM-DD date), kept up to date on every write
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._days = {}
+        self._months = {}
+        self._totals = [0, 0.0]
+
+    def rebuild(self, records):
+        self._days = {}
+        self._months = {}
+        self._totals = [0, 0.0]
+        for record in records:
+            self._add(record, 1)
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._add(old, -1)
+        if record is not None:
+            self._add(record, 1)
+
+    def _add(self, record, sign):
+        date = record.get('date') or ''
+        amount = record.get('amount') or 0
+        for buckets, key in ((self._days, date), (self._months, date[:7])):
+            bucket = buckets.setdefault(key, [0, 0.0])
+            bucket[0] += sign
+            bucket[1] += sign * amount
+            if bucket[0] == 0:
+                del buckets[key]
+        self._totals[0] += sign
+        self._totals[1] += sign * amount
+
+    @staticmethod
+    def _summary(bucket):
+        count, total = bucket or (0, 0.0)
+        return {'count': count, 'total': round(total, 2)}
+
+    def totals(self):
+        self.sync()
+        with self._lock:
+            return self._summary(self._totals)
+
+    def day(self, date):
+        self.sync()
+        with self._lock:
+            return self._summary(self._days.get(date))
+
+    def month(self, month):
+        self.sync()
+        with self._lock:
+            return self._summary(self._months.get(month))
+
+    def days(self, limit=30):
+        self.sync()
+        with self._lock:
+            return [dict(self._summary(self._days[d]), date=d) for d in sorted(self._days)[-limit:]]
+
+    def months(self, limit=12):
+        self.sync()
+        with self._lock:
+            return [dict(self._summary(self._months[m]), month=m) for m in sorted(self._months)[-limit:]]
+
+
+class PeriodIndex(StoreIndex):
+    # Per day and per month (keyed by YYYY-MM-DD / YYYY-MM): deposit count,
+    # a content digest that changes whenever a deposit in the period is
+    # added, edited or removed, and the customers with deposits in it
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._periods = {}
+
+    def rebuild(self, records):
+        self._periods = {}
+        for record in records:
+            self._add(record, 1)
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._add(old, -1)
+        if record is not None:
+            self._add(record, 1)
+
+    def _add(self, record, sign):
+        date = record.get('date') or ''
+        digest = record_digest(record)
+        customer_id = record['customer_id']
+        for period in (('day', date), ('month', date[:7])):
+            entry = self._periods.setdefault(period, [0, 0, defaultdict(int)])
+            entry[0] += sign
+            entry[1] ^= digest
+            entry[2][customer_id] += sign
+            if entry[2][customer_id] <= 0:
+                del entry[2][customer_id]
+            if entry[0] <= 0:
+                del self._periods[period]
+
+    def summary(self, kind, period):
+        self.sync()
+        with self._lock:
+            count, digest, customers = self._periods.get((kind, period), (0, 0, {}))
+            return {'count': count, 'digest': digest, 'customer_ids': sorted(customers)}
+
+    def periods(self, kind):
+        self.sync()
+        with self._lock:
+            return sorted(period for k, period in self._periods if k == kind)
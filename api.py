@@ -0,0 +1,291 @@
+import math
+import base64
+import binascii
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request, url_for
+
+from aggregates import deposit_totals
+
+# JSON API under /api/v1. It uses the same login session as the web pages
+# (log in through /login and keep the cookie). Request bodies must be JSON,
+# which also keeps plain cross-site form posts out.
+#
+# List calls return {"data": [...], "next_cursor": ...}; pass next_cursor
+# back as ?cursor= for the next page. Pages are keyed on the record id, so
+# they stay consistent while records are added. A page starts at its cursor
+# (a binary search on the JSON stores, the primary key on SQLite) and
+# nothing is counted, so deep pages don't cost more than the first.
+
+LIST_LIMIT_DEFAULT = 100
+LIST_LIMIT_MAX = 1000
+BATCH_MAX = 5000
+CUSTOMER_FIELDS = ('name', 'phone', 'email', 'loan_number', 'address')
+CUSTOMER_SEARCH_FIELDS = ('name', 'phone', 'loan_number')
+TOTALS_GROUPS = ('customer', 'month', 'day')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.errors = errors
+
+
+def encode_cursor(record_id):
+    return base64.urlsafe_b64encode(str(record_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ApiError(400, 'Invalid cursor')
+
+
+def validate_customer(data, partial=False):
+    # Returns (fields, errors); errors maps field name to message
+    fields, errors = {}, {}
+    for name in CUSTOMER_FIELDS:
+        if name not in data:
+            continue
+        value = data[name]
+        if value is not None and not isinstance(value, str):
+            errors[name] = 'must be a string'
+        else:
+            fields[name] = value
+    if not partial or 'name' in data:
+        if not (fields.get('name') or '').strip():
+            errors['name'] = 'is required'
+    return fields, errors
+
+
+def validate_deposit(data, partial=False):
+    # Same rules as the add deposit form: a customer, a non-zero amount and a
+    # YYYY-MM-DD date. Whether the customer exists is checked by the caller.
+    fields, errors = {}, {}
+    if 'customer_id' in data or not partial:
+        value = data.get('customer_id')
+        if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+            fields['customer_id'] = value
+        else:
+            errors['customer_id'] = 'must be a customer id'
+    if 'amount' in data or not partial:
+        value = data.get('amount')
+        try:
+            amount = float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+        except OverflowError:
+            amount = 0
+        # The JSON parser accepts NaN and Infinity, which would poison every total
+        if amount and math.isfinite(amount):
+            fields['amount'] = amount
+        else:
+            errors['amount'] = 'must be a non-zero number'
+    if 'date' in data or not partial:
+        value = data.get('date')
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+            fields['date'] = value
+        except (TypeError, ValueError):
+            errors['date'] = 'must be a YYYY-MM-DD date'
+    if 'notes' in data:
+        value = data['notes']
+        if value is not None and not isinstance(value, str):
+            errors['notes'] = 'must be a string'
+        else:
+            fields['notes'] = value or ''
+    elif not partial:
+        fields['notes'] = ''
+    return fields, errors
+
+
+def json_body():
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ApiError(400, 'Expected a JSON body')
+    return data
+
+
+def json_object():
+    data = json_body()
+    if not isinstance(data, dict):
+        raise ApiError(400, 'Expected a JSON object')
+    return data
+
+
+def page_args():
+    limit = request.args.get('limit', LIST_LIMIT_DEFAULT, type=int)
+    limit = min(max(limit, 1), LIST_LIMIT_MAX)
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def list_page(store, filters=(), search=None):
+    limit, after = page_args()
+    filters = list(filters)
+    if after is not None:
+        filters.append(('id', '>', after))
+    # One extra row tells us whether there is a next page
+    rows, _ = store.query(filters, search=search, sort='id', limit=limit + 1, count=False)
+    next_cursor = encode_cursor(rows[limit - 1]['id']) if len(rows) > limit else None
+    return jsonify({'data': rows[:limit], 'next_cursor': next_cursor})
+
+
+def create_blueprint(customers_store, deposits_store, current_user, ledger=None):
+    bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+    @bp.before_request
+    def require_login():
+        if current_user() is None:
+            raise ApiError(401, 'Authentication required')
+
+    @bp.errorhandler(ApiError)
+    def handle_api_error(e):
+        body = {'error': e.message}
+        if e.errors is not None:
+            body['errors'] = e.errors
+        return jsonify(body), e.status
+
+    def get_or_404(store, record_id, kind):
+        record = store.get(record_id)
+        if record is None:
+            raise ApiError(404, f'{kind} not found')
+        return record
+
+    def check_customers(customer_ids):
+        # Customer ids that don't exist
+        found = customers_store.get_many(set(customer_ids))
+        return {i for i in customer_ids if i not in found}
+
+    def created(record, endpoint, **values):
+        response = jsonify(record)
+        response.status_code = 201
+        response.headers['Location'] = url_for(endpoint, **values)
+        return response
+
+    # Customers
+    @bp.route('/customers')
+    def list_customers():
+        q = request.args.get('q', '').strip()
+        return list_page(customers_store, search=(CUSTOMER_SEARCH_FIELDS, q) if q else None)
+
+    @bp.route('/customers/<int:customer_id>')
+    def get_customer(customer_id):
+        return jsonify(get_or_404(customers_store, customer_id, 'Customer'))
+
+    @bp.route('/customers', methods=['POST'])
+    def create_customer():
+        fields, errors = validate_customer(json_object())
+        if errors:
+            raise ApiError(422, 'Invalid customer', errors)
+        customer = customers_store.insert(dict(fields, created_at=datetime.now().isoformat()))
+        return created(customer, '.get_customer', customer_id=customer['id'])
+
+    @bp.route('/customers/<int:customer_id>', methods=['PUT', 'PATCH'])
+    def update_customer(customer_id):
+        fields, errors = validate_customer(json_object(), partial=request.method == 'PATCH')
+        if errors:
+            raise ApiError(422, 'Invalid customer', errors)
+        customer = customers_store.update(customer_id, dict(fields, updated_at=datetime.now().isoformat()))
+        if customer is None:
+            raise ApiError(404, 'Customer not found')
+        return jsonify(customer)
+
+    # Deposits
+    def deposit_filters():
+        filters = []
+        customer_id = request.args.get('customer_id', type=int)
+        if customer_id:
+            filters.append(('customer_id', '==', customer_id))
+        if request.args.get('date_from'):
+            filters.append(('date', '>=', request.args['date_from']))
+        if request.args.get('date_to'):
+            filters.append(('date', '<=', request.args['date_to']))
+        return filters
+
+    @bp.route('/deposits')
+    def list_deposits():
+        return list_page(deposits_store, deposit_filters())
+
+    @bp.route('/deposits/totals')
+    def deposit_totals_view():
+        # ?by=customer|month|day plus the list filters
+        by = request.args.get('by', 'month')
+        if by not in TOTALS_GROUPS:
+            raise ApiError(400, f'by must be one of {", ".join(TOTALS_GROUPS)}')
+        filters = deposit_filters()
+        if ledger is not None and ledger.supports(filters):
+            totals = ledger.totals(by, filters)
+        else:
+            totals = deposit_totals(deposits_store.iter_batches(filters), by)
+        return jsonify({'by': by, 'data': [dict(v, key=k) for k, v in totals.items()]})
+
+    @bp.route('/deposits/<int:deposit_id>')
+    def get_deposit(deposit_id):
+        return jsonify(get_or_404(deposits_store, deposit_id, 'Deposit'))
+
+    @bp.route('/deposits', methods=['POST'])
+    def create_deposit():
+        fields, errors = validate_deposit(json_object())
+        if errors:
+            raise ApiError(422, 'Invalid deposit', errors)
+        # Same lock order as delete_customer, so the customer can't go away in
+        # between. Errors are raised once the transactions have ended cleanly.
+        deposit = None
+        with deposits_store.transaction(), customers_store.transaction():
+            if not check_customers([fields['customer_id']]):
+                deposit = deposits_store.insert(dict(fields, created_at=datetime.now().isoformat()))
+        if deposit is None:
+            raise ApiError(422, 'Invalid deposit', {'customer_id': 'customer not found'})
+        return created(deposit, '.get_deposit', deposit_id=deposit['id'])
+
+    @bp.route('/deposits/<int:deposit_id>', methods=['PUT', 'PATCH'])
+    def update_deposit(deposit_id):
+        fields, errors = validate_deposit(json_object(), partial=request.method == 'PATCH')
+        if errors:
+            raise ApiError(422, 'Invalid deposit', errors)
+        with deposits_store.transaction(), customers_store.transaction():
+            missing = 'customer_id' in fields and check_customers([fields['customer_id']])
+            if not missing:
+                deposit = deposits_store.update(deposit_id, dict(fields, updated_at=datetime.now().isoformat()))
+        if missing:
+            raise ApiError(422, 'Invalid deposit', {'customer_id': 'customer not found'})
+        if deposit is None:
+            raise ApiError(404, 'Deposit not found')
+        return jsonify(deposit)
+
+    @bp.route('/deposits/batch', methods=['POST'])
+    def create_deposits():
+        # {"deposits": [...]} (or a bare list). Every row is validated first;
+        # if any is invalid nothing is saved and the errors are reported by
+        # row index. Otherwise all rows are written in a single store write.
+        data = json_body()
+        rows = data.get('deposits') if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not rows:
+            raise ApiError(400, 'Expected a non-empty list of deposits')
+        if len(rows) > BATCH_MAX:
+            raise ApiError(400, f'At most {BATCH_MAX} deposits per batch')
+        deposits, errors = [], []
+        now = datetime.now().isoformat()
+        for index, row in enumerate(rows):
+            if isinstance(row, dict):
+                fields, row_errors = validate_deposit(row)
+            else:
+                fields, row_errors = {}, {'deposit': 'must be an object'}
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+            deposits.append(dict(fields, created_at=now))
+        if errors:
+            raise ApiError(422, 'Invalid deposits; nothing was saved', errors)
+        with deposits_store.transaction(), customers_store.transaction():
+            missing = check_customers([d['customer_id'] for d in deposits])
+            if not missing:
+                deposits = deposits_store.insert_many(deposits)
+        if missing:
+            raise ApiError(422, 'Invalid deposits; nothing was saved',
+                           [{'index': index, 'errors': {'customer_id': 'customer not found'}}
+                            for index, d in enumerate(deposits) if d['customer_id'] in missing])
+        return jsonify({'data': deposits, 'count': len(deposits)}), 201
+
+    return bp
@@ -0,0 +1,115 @@
+import io
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+# The logo is shown at most 100px high (settings page); twice that keeps it
+# sharp on high-DPI screens
+LOGO_MAX_SIZE = (600, 200)
+# Larger uploads are rejected before they are decoded
+LOGO_MAX_BYTES = 2 * 1024 * 1024
+# Leading bytes of the formats accepted as logos (PNG, JPEG, GIF)
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a')
+
+
+def optimize_logo(data, max_size=LOGO_MAX_SIZE, max_bytes=LOGO_MAX_BYTES):
+    # Returns the bytes to serve for an uploaded logo: scaled down to fit
+    # max_size and re-encoded as an optimized PNG. Raises ValueError for
+    # files that aren't images or are too large.
+    if len(data) > max_bytes:
+        raise ValueError(f'Logo must be smaller than {max_bytes // 1024} KB')
+    if not data.startswith(IMAGE_SIGNATURES):
+        raise ValueError('Logo must be a PNG, JPEG or GIF image')
+    # Imported here so workers don't pay for Pillow until someone uploads a logo
+    from PIL import Image
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception:
+        raise ValueError('Logo must be a PNG, JPEG or GIF image')
+    image.thumbnail(max_size)
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+        image = image.convert('RGBA')
+    out = io.BytesIO()
+    image.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+class AssetRegistry:
+    # In-memory view of uploaded assets under one directory (the logo):
+    # whether each exists and a content hash used to version its URL.
+    # Uploads and removals through this registry update it straight away;
+    # changes made by other workers are picked up by a stat() at most every
+    # `ttl` seconds, so page renders normally don't touch the filesystem.
+
+    def __init__(self, directory, names, ttl=5.0):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._assets = {name: (None, None) for name in names}  # name -> (signature, version)
+        self._checked = 0.0
+        self.refresh()
+
+    def path_for(self, name):
+        return os.path.join(self.directory, name)
+
+    def _stat(self, name):
+        try:
+            st = os.stat(self.path_for(name))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _fingerprint(self, name):
+        with open(self.path_for(name), 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+    def refresh(self):
+        with self._lock:
+            for name, (signature, version) in self._assets.items():
+                current = self._stat(name)
+                if current != signature:
+                    try:
+                        version = self._fingerprint(name) if current is not None else None
+                    except FileNotFoundError:
+                        current, version = None, None
+                    self._assets[name] = (current, version)
+            self._checked = time.monotonic()
+
+    def version(self, name):
+        # Content hash of the asset, or None if it doesn't exist
+        if time.monotonic() - self._checked >= self.ttl:
+            self.refresh()
+        return self._assets[name][1]
+
+    def exists(self, name):
+        return self.version(name) is not None
+
+    def save(self, name, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # mkstemp creates 0600 files; static assets may be served by a front-end server
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path_for(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._assets[name] = (self._stat(name), hashlib.blake2b(data, digest_size=8).hexdigest())
+
+    def remove(self, name):
+        # Returns False if there was nothing to remove
+        try:
+            os.remove(self.path_for(name))
+            removed = True
+        except FileNotFoundError:
+            removed = False
+        with self._lock:
+            self._assets[name] = (None, None)
+        return removed
@@ -0,0 +1,216 @@
+import os
+import hmac
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from store import StoreIndex
+
+# werkzeug's default; the cost is part of the method string, e.g.
+# 'scrypt:16384:8:1' or 'pbkdf2:sha256:600000'
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(HASH_PREFIXES) and stored.count('$') == 2
+
+
+class PasswordHasher:
+    # Hashes and checks passwords with a KDF. Successful checks are kept in
+    # a small per-process LRU keyed by the stored hash and an HMAC of the
+    # password (under a random per-process key), so a burst of logins to
+    # the same account runs the KDF once. A password change alters the
+    # stored hash, so old entries simply stop matching.
+
+    def __init__(self, method=DEFAULT_HASH_METHOD, cache_size=1024):
+        self.method = method
+        self.cache_size = cache_size
+        self._key = os.urandom(32)
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method)
+
+    def needs_rehash(self, stored):
+        # Plaintext from before hashing, or hashed with a different cost
+        return not is_hashed(stored) or stored.split('$', 1)[0] != self.method
+
+    def verify(self, stored, password):
+        if not stored or not password:
+            return False
+        token = (stored, hmac.new(self._key, password.encode(), hashlib.sha256).digest())
+        with self._lock:
+            if token in self._verified:
+                self._verified.move_to_end(token)
+                return True
+        if is_hashed(stored):
+            ok = check_password_hash(stored, password)
+        else:
+            ok = hmac.compare_digest(stored.encode(), password.encode())
+        if ok:
+            with self._lock:
+                self._verified[token] = True
+                while len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        return ok
+
+
+def hash_plaintext_passwords(store, hasher):
+    # One-off migration of users saved before passwords were hashed. Only
+    # takes the write lock when there is something to convert.
+    if not any(u.get('password') and not is_hashed(u['password']) for u in store.all()):
+        return 0
+    with store.transaction():
+        changes = [(u['id'], {'password': hasher.hash(u['password'])}) for u in store.all()
+                   if u.get('password') and not is_hashed(u['password'])]
+        store.update_many(changes)
+    return len(changes)
+
+
+class UserIndex(StoreIndex):
+    # username -> user, for login and the username uniqueness checks
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._by_username = {}
+
+    def rebuild(self, records):
+        self._by_username = {r.get('username'): dict(r) for r in records}
+
+    def apply(self, op, record, old):
+        if old is not None and self._by_username.get(old.get('username'), {}).get('id') == old['id']:
+            del self._by_username[old.get('username')]
+        if record is not None:
+            self._by_username[record.get('username')] = dict(record)
+
+    def get(self, username):
+        self.sync()
+        with self._lock:
+            user = self._by_username.get(username)
+            return dict(user) if user is not None else None
+
+    def taken(self, username, user_id=None):
+        # True if another user (not user_id) already has this username
+        user = self.get(username)
+        return user is not None and user['id'] != user_id
+
+
+class SessionIndex(StoreIndex):
+    # token -> server-side session record
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._by_token = {}
+
+    def rebuild(self, records):
+        self._by_token = {r['token']: dict(r) for r in records}
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._by_token.pop(old['token'], None)
+        if record is not None:
+            self._by_token[record['token']] = dict(record)
+
+    def get(self, token):
+        self.sync()
+        with self._lock:
+            record = self._by_token.get(token)
+            return dict(record) if record is not None else None
+
+
+class ActiveUserCache:
+    # Per-process LRU of the users behind recent requests. Local user writes
+    # evict the affected entries through the store listener; a write by
+    # another worker changes the store version and empties the cache.
+
+    def __init__(self, store, size=256):
+        self.store = store
+        self.size = size
+        self._users = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        store.subscribe(self._on_change)
+
+    def _on_change(self, op, record, old, previous, version):
+        with self._lock:
+            if op == 'reset' or previous != self._version:
+                self._users.clear()
+                self._version = None
+                return
+            for item in (record if isinstance(record, list) else [record]) + \
+                    (old if isinstance(old, list) else [old]):
+                if item is not None:
+                    self._users.pop(item['id'], None)
+            self._version = version
+
+    def get(self, user_id):
+        version = self.store.version()
+        with self._lock:
+            if version != self._version:
+                self._users.clear()
+                self._version = version
+            user = self._users.get(user_id)
+            if user is not None:
+                self._users.move_to_end(user_id)
+                return dict(user)
+        user = self.store.get(user_id)
+        if user is not None:
+            with self._lock:
+                if self._version == version:
+                    self._users[user_id] = user
+                    while len(self._users) > self.size:
+                        self._users.popitem(last=False)
+            user = dict(user)
+        return user
+
+
+class SessionManager:
+    # Server-side login sessions. The cookie only carries a random token;
+    # every request resolves it to a session record and then to the current
+    # user record, so deleted or demoted users lose access straight away.
+
+    def __init__(self, store, users_store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+        self.index = SessionIndex(store)
+        self.users = ActiveUserCache(users_store)
+
+    def start(self, user):
+        now = datetime.now()
+        with self.store.transaction():
+            # Expired sessions are cleared out whenever someone logs in
+            expired, _ = self.store.query(filters=[('expires_at', '<=', now.isoformat())])
+            for record in expired:
+                self.store.delete(record['id'])
+            record = self.store.insert({
+                'token': secrets.token_urlsafe(32),
+                'user_id': user['id'],
+                'created_at': now.isoformat(),
+                'expires_at': (now + self.lifetime).isoformat()
+            })
+        return record['token']
+
+    def end(self, token):
+        record = self.index.get(token) if token else None
+        if record is not None:
+            self.store.delete(record['id'])
+
+    def end_user(self, user_id):
+        with self.store.transaction():
+            records, _ = self.store.query(filters=[('user_id', '==', user_id)])
+            for record in records:
+                self.store.delete(record['id'])
+
+    def resolve(self, token):
+        # Returns the session's user, or None if the session is unknown,
+        # expired or its user no longer exists
+        record = self.index.get(token) if token else None
+        if record is None or record['expires_at'] <= datetime.now().isoformat():
+            return None
+        return self.users.get(record['user_id'])
@@ -0,0 +1,327 @@
+"""Benchmark the main routes against synthetic data.
+
+    python bench.py --scale 1k                 # run and compare to the baseline
+    python bench.py --scale 100k --backend sqlite
+    python bench.py --scale 1k --update-baseline
+
+Generates customers/deposits/users in a temporary data/ directory, starts
+the app there and drives the real routes through Flask's test client,
+reporting throughput, p50/p99 latency and peak RSS per scenario. Each
+scenario is timed --repeats times and the median p50 is kept, so one noisy
+run doesn't decide the result. Results are compared with bench_baseline.json
+(keyed by backend and scale); a p50 more than --tolerance and --min-delta-ms
+slower than the baseline is reported as a regression.
+
+The committed baseline was recorded on a developer machine, so on other
+hardware it is only a reference. To gate a change (CI), record a baseline
+on the same machine first and run with --check, which exits with status 1
+on regressions:
+
+    git checkout <base> && python bench.py --update-baseline --baseline /tmp/base.json
+    git checkout - && python bench.py --baseline /tmp/base.json --check
+
+App startup (a cold `import main` in a fresh interpreter, median of a few
+runs) is checked against STARTUP_TARGET_SECONDS, and must not load pandas
+or openpyxl.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import shutil
+import subprocess
+from datetime import date, timedelta
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# Cold `import main` budget; pandas/openpyxl alone would take longer than this
+STARTUP_TARGET_SECONDS = 0.35
+HEAVY_MODULES = ('pandas', 'openpyxl')
+STARTUP_SCRIPT = (
+    'import sys, time, json; t = time.perf_counter(); import main; '
+    'print(json.dumps([time.perf_counter() - t, [m for m in %r if m in sys.modules]]))' % (HEAVY_MODULES,))
+FIRST_NAMES = ['Asha', 'Ben', 'Chen', 'Dina', 'Emeka', 'Farah', 'Goran', 'Hana', 'Ivan', 'Jia']
+LAST_NAMES = ['Kumar', 'Lopez', 'Mensah', 'Nakamura', 'Okafor', 'Petrov', 'Quinn', 'Rossi']
+
+
+def parse_scale(value):
+    value = value.lower()
+    return SCALES[value] if value in SCALES else int(value)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def write_json_list(path, records):
+    # Streamed so the 1M-deposit file never exists as one big string
+    with open(path, 'w') as f:
+        f.write('[')
+        for i, record in enumerate(records):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(record))
+        f.write(']')
+
+
+def customer_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def generate_data(data_dir, deposits, customers, seed=42):
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    write_json_list(os.path.join(data_dir, 'customers.json'), (
+        {'id': i, 'name': customer_name(rng), 'phone': f'555{i:07d}', 'email': f'c{i}@example.com',
+         'loan_number': f'LN{i:08d}', 'address': f'{i} Main St', 'created_at': '2024-01-01T00:00:00'}
+        for i in range(1, customers + 1)))
+    start = date(2022, 1, 1)
+    write_json_list(os.path.join(data_dir, 'deposits.json'), (
+        {'id': i, 'customer_id': rng.randint(1, customers), 'amount': round(rng.uniform(10, 5000), 2),
+         'date': (start + timedelta(days=rng.randrange(1000))).isoformat(), 'notes': '',
+         'created_at': '2024-01-01T00:00:00'}
+        for i in range(1, deposits + 1)))
+    write_json_list(os.path.join(data_dir, 'users.json'), [
+        {'id': 1, 'username': 'admin', 'email': 'admin@example.com', 'password': 'admin123',
+         'role': 'admin', 'created_at': '2024-01-01T00:00:00'}])
+
+
+def import_csv(start, rows):
+    lines = ['name,phone,email,loan_number,address']
+    lines += [f'Bench Import {i},777{i:07d},i{i}@example.com,IMP{i:08d},{i} Side St'
+              for i in range(start, start + rows)]
+    return io.BytesIO(('\n'.join(lines) + '\n').encode())
+
+
+def measure_startup(workdir, backend, runs=5):
+    env = dict(os.environ, STORAGE_BACKEND=backend,
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    times, heavy = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=workdir, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        seconds, loaded = json.loads(output.strip().splitlines()[-1])
+        times.append(seconds)
+        heavy.update(loaded)
+    return percentile(times, 50), sorted(heavy)
+
+
+class Bench:
+    def __init__(self, main, customers, rng):
+        self.main = main
+        self.customers = customers
+        self.rng = rng
+        self.client = main.app.test_client()
+        self.imported = 0
+
+    def login(self):
+        response = self.client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        assert response.status_code == 302, 'login failed'
+
+    def get(self, url):
+        response = self.client.get(url)
+        assert response.status_code == 200, f'{url} -> {response.status_code}'
+        return response
+
+    def wait_job(self, response):
+        # Exports and imports redirect to /jobs/<id>; the time includes the job
+        job_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+        while True:
+            job = self.main.job_queue.get(job_id)
+            if job['status'] == 'done':
+                return job
+            if job['status'] == 'failed':
+                raise RuntimeError(f'job {job_id} failed: {job["message"]}')
+            time.sleep(0.001)
+
+    def deposits_page(self):
+        self.get(f'/deposits?page={self.rng.randint(1, 20)}')
+
+    def deposits_filtered(self):
+        month = f'2023-{self.rng.randint(1, 12):02d}'
+        self.get(f'/deposits?date_from={month}-01&date_to={month}-28&amount_min=1000&sort=-amount')
+
+    def add_deposit(self):
+        response = self.client.post('/add_deposit', data={
+            'customer_id': self.rng.randint(1, self.customers), 'amount': '125.50',
+            'date': '2024-06-01', 'notes': 'bench'})
+        assert response.status_code == 302, f'add_deposit -> {response.status_code}'
+
+    def export_excel(self):
+        month = f'2023-{self.rng.randint(1, 12):02d}'
+        response = self.client.get(f'/export_excel?date_from={month}-01&date_to={month}-28')
+        self.wait_job(response)
+
+    def export_csv(self):
+        month = f'2023-{self.rng.randint(1, 12):02d}'
+        self.get(f'/export_excel?format=csv&date_from={month}-01&date_to={month}-28').get_data()
+
+    def import_customers(self):
+        data = import_csv(self.imported, 1000)
+        self.imported += 1000
+        response = self.client.post('/import_customers', data={'file': (data, 'bench.csv')},
+                                    content_type='multipart/form-data')
+        self.wait_job(response)
+
+    def customer_report(self):
+        self.get(f'/customer_report/{self.rng.randint(1, self.customers)}').get_data()
+
+    def dashboard(self):
+        self.get('/')
+
+
+# (name, method, share of --requests); slow background jobs run fewer times
+SCENARIOS = [
+    ('dashboard', 'dashboard', 1),
+    ('deposits', 'deposits_page', 1),
+    ('deposits_filtered', 'deposits_filtered', 1),
+    ('add_deposit', 'add_deposit', 1),
+    ('customer_report', 'customer_report', 0.2),
+    ('export_csv', 'export_csv', 0.1),
+    ('export_excel', 'export_excel', 0.1),
+    ('import_customers', 'import_customers', 0.1),
+]
+
+
+def run_scenario(bench, method, count, repeats=1):
+    # p50 is the median of the per-run p50s; throughput and p99 are taken
+    # over all the requests
+    func = getattr(bench, method)
+    latencies, medians, elapsed = [], [], 0.0
+    for _ in range(repeats):
+        run = []
+        started = time.perf_counter()
+        for _ in range(count):
+            t0 = time.perf_counter()
+            func()
+            run.append(time.perf_counter() - t0)
+        elapsed += time.perf_counter() - started
+        latencies.extend(run)
+        medians.append(percentile(run, 50))
+    return {
+        'requests': count * repeats,
+        'repeats': repeats,
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(medians, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms=0.0):
+    # p50 change against the baseline per scenario, and the scenarios that
+    # slowed down by more than tolerance (and by more than min_delta_ms, so
+    # sub-millisecond routes aren't flagged for timer noise)
+    changes, regressions = {}, []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get('p50_ms'):
+            continue
+        changes[name] = round(result['p50_ms'] / base['p50_ms'] - 1, 3)
+        if changes[name] > tolerance and result['p50_ms'] - base['p50_ms'] > min_delta_ms:
+            regressions.append(name)
+    return changes, regressions
+
+
+def print_table(results, changes):
+    print(f'{"scenario":<20}{"n":>6}{"req/s":>10}{"p50 ms":>11}{"p99 ms":>11}{"RSS MB":>9}{"vs base":>9}')
+    for name, r in results.items():
+        change = f'{changes[name]:+.0%}' if name in changes else '-'
+        print(f'{name:<20}{r["requests"]:>6}{r["throughput"]:>10}{r["p50_ms"]:>11}{r["p99_ms"]:>11}'
+              f'{r["peak_rss_mb"]:>9}{change:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the deposit tracker routes')
+    parser.add_argument('--scale', default='1k', help='deposits to generate: 1k, 100k, 1m or a number')
+    parser.add_argument('--customers', type=int, help='customers to generate (default: deposits / 10)')
+    parser.add_argument('--backend', default='json', choices=['json', 'sqlite'])
+    parser.add_argument('--requests', type=int, default=50, help='requests per fast scenario')
+    parser.add_argument('--repeats', type=int, default=5, help='timed runs per scenario (median p50 is kept)')
+    parser.add_argument('--only', help='comma-separated scenarios to run')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed p50 slowdown (0.5 = 50%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help='p50 slowdowns smaller than this many ms are never regressions')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with status 1 on regressions (use a baseline from the same machine)')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data directory')
+    args = parser.parse_args()
+
+    deposits = parse_scale(args.scale)
+    customers = args.customers or max(100, deposits // 10)
+    key = f'{args.backend}-{args.scale.lower()}'
+    workdir = tempfile.mkdtemp(prefix='deposit-bench-')
+    try:
+        t0 = time.perf_counter()
+        generate_data(os.path.join(workdir, 'data'), deposits, customers)
+        print(f'Generated {deposits} deposits / {customers} customers in {time.perf_counter() - t0:.1f}s ({workdir})')
+
+        startup, heavy = measure_startup(workdir, args.backend)
+        print(f'Cold startup {startup:.3f}s (target {STARTUP_TARGET_SECONDS}s)'
+              + (f', loaded {", ".join(heavy)}' if heavy else ''))
+
+        # main.py keeps its data under ./data, so start it from the work dir
+        os.chdir(workdir)
+        os.environ['STORAGE_BACKEND'] = args.backend
+        # Background report pregeneration would run during the timed scenarios
+        os.environ.setdefault('REPORT_SCHEDULE_SECONDS', '0')
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main as app_main
+        print(f'App loaded, peak RSS {peak_rss_mb():.0f} MB')
+
+        bench = Bench(app_main, customers, random.Random(7))
+        bench.login()
+        only = set(args.only.split(',')) if args.only else None
+        results = {}
+        for name, method, share in SCENARIOS:
+            if only and name not in only:
+                continue
+            getattr(bench, method)()  # warm caches and indexes first
+            results[name] = run_scenario(bench, method, max(1, int(args.requests * share)), args.repeats)
+    finally:
+        os.chdir('/')
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    changes, regressions = compare(results, baselines.get(key, {}).get('scenarios', {}), args.tolerance,
+                                   args.min_delta_ms)
+    if startup > STARTUP_TARGET_SECONDS or heavy:
+        regressions.append('startup')
+    print_table(results, changes)
+    report = {'startup_seconds': round(startup, 3), 'startup_heavy_modules': heavy, 'deposits': deposits, 'customers': customers,
+              'scenarios': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        baselines[key] = report
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f'Baseline {key} updated in {args.baseline}')
+    elif regressions:
+        print(f'Regressions beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
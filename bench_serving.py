@@ -0,0 +1,184 @@
+"""Compare the gunicorn serving profiles under slow clients.
+
+    python bench_serving.py                         # sync vs gthread, 1k deposits
+    python bench_serving.py --workers 2 --slow 4 --duration 15
+
+For each profile in gunicorn.conf.py (SERVER_PROFILE=sync / gthread) the
+app is started under gunicorn on freshly generated data. While --slow
+clients trickle CSV uploads to /import_customers (each taking about
+--upload-seconds, like a branch office on a slow link), --clients threads
+keep requesting the dashboard and deposit list. The report shows how many
+of those fast requests each profile served and their latency: a slow
+upload holds a whole sync worker, but only one thread of a gthread worker.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import tempfile
+import shutil
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+from bench import generate_data, import_csv, parse_scale, percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(REPO_DIR, 'gunicorn.conf.py')
+PROFILES = ('sync', 'gthread')
+BOUNDARY = 'bench-serving-boundary'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, profile, port, workers, threads):
+    env = dict(os.environ, SERVER_PROFILE=profile, WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', CONFIG_FILE, '--bind', f'127.0.0.1:{port}',
+         '--pythonpath', REPO_DIR, 'main:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/login')
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({profile}) did not start')
+
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request('POST', '/login', urlencode({'username': 'admin', 'password': 'admin123'}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 302, f'login failed: {response.status}'
+    return response.getheader('Set-Cookie').split(';', 1)[0]
+
+
+def upload_body(start, rows):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="bench.csv"\r\n'
+            f'Content-Type: text/csv\r\n\r\n').encode() + import_csv(start, rows).getvalue() + \
+        f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def slow_client(port, cookie, index, stop, upload_seconds, results):
+    # Sends an upload in 20 slices spread over upload_seconds, again and again
+    uploads = 0
+    while not stop.is_set():
+        body = upload_body(1000000 * (index + 1) + uploads * 100, 100)
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            conn.putrequest('POST', '/import_customers')
+            conn.putheader('Cookie', cookie)
+            conn.putheader('Content-Type', f'multipart/form-data; boundary={BOUNDARY}')
+            conn.putheader('Content-Length', str(len(body)))
+            conn.endheaders()
+            step = len(body) // 20 + 1
+            for offset in range(0, len(body), step):
+                conn.send(body[offset:offset + step])
+                time.sleep(upload_seconds / 20)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status == 302:
+                uploads += 1
+        except OSError:
+            pass
+    results.append(uploads)
+
+
+def fast_client(port, cookie, seed, stop, latencies, errors):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while not stop.is_set():
+        url = rng.choice(['/', f'/deposits?page={rng.randint(1, 20)}'])
+        started = time.perf_counter()
+        try:
+            conn.request('GET', url, headers={'Cookie': cookie})
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise OSError(f'{url} -> {response.status}')
+            latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            errors.append(url)
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+
+def run_profile(args, profile, deposits, customers):
+    workdir = tempfile.mkdtemp(prefix=f'deposit-serving-{profile}-')
+    server = None
+    try:
+        generate_data(os.path.join(workdir, 'data'), deposits, customers)
+        port = free_port()
+        server = start_server(workdir, profile, port, args.workers, args.threads)
+        cookie = login(port)
+        stop = threading.Event()
+        latencies, errors, uploads = [], [], []
+        threads = [threading.Thread(target=slow_client, args=(port, cookie, i, stop, args.upload_seconds, uploads))
+                   for i in range(args.slow)]
+        threads += [threading.Thread(target=fast_client, args=(port, cookie, i, stop, latencies, errors))
+                    for i in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        served = len(latencies)
+        return {
+            'fast_requests': served,
+            'throughput': round(served / args.duration, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1) if served else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1) if served else None,
+            'errors': len(errors),
+            'uploads': sum(uploads),
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='1k', help='deposits to generate: 1k, 100k, 1m or a number')
+    parser.add_argument('--profiles', default=','.join(PROFILES), help='comma-separated profiles to compare')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes (WEB_CONCURRENCY)')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent fast clients')
+    parser.add_argument('--slow', type=int, default=2, help='concurrent slow uploads')
+    parser.add_argument('--upload-seconds', type=float, default=2.0, help='time each slow upload takes')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run each profile')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data directories')
+    args = parser.parse_args()
+
+    deposits = parse_scale(args.scale)
+    customers = max(100, deposits // 10)
+    print(f'{args.workers} workers, {args.clients} fast clients, {args.slow} slow uploads '
+          f'of {args.upload_seconds}s, {args.duration}s per profile')
+    print(f'{"profile":<10}{"served":>8}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}{"uploads":>9}')
+    for profile in args.profiles.split(','):
+        r = run_profile(args, profile, deposits, customers)
+        print(f'{profile:<10}{r["fast_requests"]:>8}{r["throughput"]:>9}{str(r["p50_ms"]):>9}'
+              f'{str(r["p99_ms"]):>9}{r["errors"]:>8}{r["uploads"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import gzip
+import zlib
+
+from flask import request
+
+# gzip for text responses (pages, CSV exports, JSON). Streamed responses
+# are compressed chunk by chunk with a sync flush, so the client still gets
+# each part of the page as soon as it's rendered. Files sent with
+# send_file (static files, xlsx downloads) are left alone.
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/csv', 'text/plain', 'application/json'}
+
+
+def close_stream(chunks):
+    # Lets a wrapped stream clean up (e.g. release its request context)
+    # when the client goes away mid-response
+    if hasattr(chunks, 'close'):
+        chunks.close()
+
+
+def buffered(chunks, size=8192):
+    # Joins the many small strings template streaming produces into
+    # writes of about `size` characters
+    pending, length = [], 0
+    try:
+        for chunk in chunks:
+            pending.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield ''.join(pending)
+                pending, length = [], 0
+        if pending:
+            yield ''.join(pending)
+    finally:
+        close_stream(chunks)
+
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close_stream(chunks)
+
+
+def init_app(app, min_size=500, level=6):
+
+    @app.after_request
+    def compress_response(response):
+        if (response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough
+                or response.status_code < 200 or response.status_code in (204, 206, 304)):
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers or request.accept_encodings['gzip'] <= 0:
+            return response
+        if response.is_streamed:
+            response.response = gzip_stream(response.response, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers['Content-Encoding'] = 'gzip'
+        # The compressed body differs byte for byte, so a strong ETag would be wrong
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
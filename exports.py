@@ -0,0 +1,59 @@
+import io
+import csv
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+DEPOSIT_EXPORT_COLUMNS = ['Deposit ID', 'Date', 'Customer Name', 'Customer Phone',
+                          'Loan Number', 'Amount', 'Notes']
+CUSTOMER_REPORT_COLUMNS = ['Date', 'Amount', 'Notes']
+
+
+def iter_deposit_rows(deposits_store, customers_store, filters=()):
+    # Joins each batch of deposits to its customers as it goes
+    for batch in deposits_store.iter_batches(filters):
+        customers = customers_store.get_many({d['customer_id'] for d in batch})
+        for deposit in batch:
+            customer = customers.get(deposit['customer_id'], {})
+            yield [
+                deposit['id'],
+                deposit['date'],
+                customer.get('name', 'Unknown'),
+                customer.get('phone', ''),
+                customer.get('loan_number', ''),
+                deposit['amount'],
+                deposit.get('notes', ''),
+            ]
+
+
+def iter_customer_report_rows(deposits):
+    for deposit in deposits:
+        yield [deposit['date'], deposit['amount'], deposit.get('notes', '')]
+
+
+def build_workbook(columns, rows):
+    # Write-only mode streams rows to disk instead of building the sheet in
+    # memory. openpyxl is imported here so only exports pay for it.
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    return workbook
+
+
+def save_xlsx(path, columns, rows):
+    build_workbook(columns, rows).save(path)
+
+
+def iter_csv(columns, rows, flush_every=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+# Template fragment caching:
+#
+#     {% cache 'recent_customers', store_version('customers') %}
+#         ...expensive markup...
+#     {% endcache %}
+#
+# The rendered block is kept per process under the tuple of all the
+# arguments, so pass whatever the block depends on (usually the version of
+# the stores it reads). The body isn't evaluated at all on a hit. Blocks
+# that show anything user-specific must include it in the key.
+
+
+class FragmentCache:
+    def __init__(self, size=256):
+        self.size = size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+        fragment = render()
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+class FragmentCacheExtension(Extension):
+    # Adds {% cache key, ... %}...{% endcache %}; the cache is whatever is
+    # assigned to environment.fragment_cache (None renders every time)
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        # The block's own position keeps equal keys in different blocks apart
+        args = [nodes.Const(parser.name), nodes.Const(lineno), nodes.List(key)]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, template, lineno, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        return cache.get_or_render((template, lineno, *key), caller)
@@ -0,0 +1,36 @@
+# Gunicorn settings. `gunicorn main:app` reads this file from the working
+# directory; SERVER_PROFILE picks how requests are served:
+#
+#   sync     (default) one request at a time per worker process, exactly as
+#            before. A slow upload or report build holds a whole process.
+#   gthread  every worker process serves GUNICORN_THREADS requests at once
+#            on a thread pool, so slow clients only hold a thread. The app's
+#            stores, indexes and caches are per process and thread-safe, so
+#            threads also share them instead of each process rebuilding its
+#            own. CPU-heavy work (customer reports, imports, exports) runs on
+#            small bounded pools inside the app (EXCEL_WORKERS, JOB_WORKERS)
+#            so it can't crowd out the fast pages.
+#
+# WEB_CONCURRENCY sets the number of worker processes for either profile.
+# Compare the two with `python bench_serving.py`.
+#
+# gevent/ASGI aren't offered: the stores block on file locks and SQLite,
+# and pandas/openpyxl are CPU-bound, so an event loop would stall on them
+# the same way a sync worker does.
+import os
+import multiprocessing
+
+profile = os.environ.get('SERVER_PROFILE', 'sync')
+
+if profile == 'gthread':
+    worker_class = 'gthread'
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+    threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+    # Idle keep-alive connections hold a thread slot, so don't keep them long
+    keepalive = 5
+elif profile == 'sync':
+    workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+else:
+    raise RuntimeError(f'Unknown SERVER_PROFILE {profile!r} (use sync or gthread)')
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
@@ -0,0 +1,202 @@
+import re
+from datetime import datetime
+
+import metrics
+from store import StoreIndex
+
+# pandas and openpyxl are imported inside the functions that use them, so
+# importing this module (as main.py does at startup) stays cheap; see warmup()
+
+CUSTOMER_FIELDS = ['name', 'phone', 'email', 'loan_number', 'address']
+
+# Rows per batch when reading uploads, bounding worker memory
+IMPORT_CHUNK_SIZE = 5000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def warmup():
+    # Loads the spreadsheet libraries ahead of the first import or export
+    with metrics.span('excel_warmup'):
+        import pandas  # noqa: F401
+        import openpyxl  # noqa: F401
+
+# Keywords used when a column is not named exactly after a field. Fields are
+# resolved in this order and a column is only used once, so "phone number"
+# becomes the phone rather than the loan number.
+COLUMN_KEYWORDS = [
+    ('name', ('name',)),
+    ('phone', ('phone',)),
+    ('email', ('email',)),
+    ('address', ('address',)),
+    ('loan_number', ('loan', 'number')),
+]
+
+
+def iter_chunks(file, filename, chunksize=IMPORT_CHUNK_SIZE):
+    # Yields DataFrames of at most chunksize rows (always at least one, so an
+    # empty sheet still gets its columns validated)
+    import pandas as pd
+    filename = filename.lower()
+    if filename.endswith('.csv'):
+        # Read as text so loan numbers keep their leading zeros
+        with pd.read_csv(file, chunksize=chunksize, dtype=str) as reader:
+            yield from reader
+    elif filename.endswith('.xlsx'):
+        yield from iter_xlsx_chunks(file, chunksize)
+    else:
+        yield pd.read_excel(file)
+
+
+def iter_xlsx_chunks(file, chunksize):
+    import pandas as pd
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        columns = [str(col) if col is not None else f'column_{i}' for i, col in enumerate(header)]
+        width = len(columns)
+        batch = []
+        yielded = False
+        for row in rows:
+            batch.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(batch) >= chunksize:
+                yield pd.DataFrame(batch, columns=columns)
+                yielded = True
+                batch = []
+        if batch or not yielded:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def resolve_columns(columns):
+    # Map each customer field to a source column, once per file
+    columns = [str(col) for col in columns]
+    lowered = {col: col.strip().lower() for col in columns}
+    mapping = {}
+    used = set()
+    for field in CUSTOMER_FIELDS:
+        exact = next((col for col in columns if lowered[col] == field), None)
+        if exact is not None:
+            mapping[field] = exact
+            used.add(exact)
+    for field, keywords in COLUMN_KEYWORDS:
+        if field in mapping:
+            continue
+        match = next((col for col in columns if col not in used
+                      and any(k in lowered[col] for k in keywords)), None)
+        if match is not None:
+            mapping[field] = match
+            used.add(match)
+    if 'name' not in mapping:
+        raise ImportFormatError('The file must contain a "name" or "Name" column')
+    return mapping
+
+
+def clean_column(series):
+    # NaN -> '', whole-number floats (Excel phone/loan numbers) lose the '.0'
+    import pandas as pd
+    if pd.api.types.is_float_dtype(series) and (series.dropna() % 1 == 0).all():
+        series = series.astype('Int64')
+    return series.astype(object).where(series.notna(), '').astype(str).str.strip()
+
+
+def build_customers(df, mapping, created_at=None):
+    # Vectorized: every field is converted column-wise, rows without a name dropped
+    import pandas as pd
+    df.columns = [str(col) for col in df.columns]
+    names = clean_column(df[mapping['name']])
+    keep = names != ''
+    customers = pd.DataFrame({'name': names[keep]})
+    for field in CUSTOMER_FIELDS[1:]:
+        customers[field] = clean_column(df[mapping[field]])[keep] if field in mapping else ''
+    customers['created_at'] = created_at or datetime.now().isoformat()
+    return customers.to_dict('records')
+
+
+def customer_key(record):
+    # Loan number identifies a customer; without one fall back to name + phone
+    loan_number = re.sub(r'\s+', '', str(record.get('loan_number') or '')).lower()
+    if loan_number:
+        return f'loan:{loan_number}'
+    name = ' '.join(str(record.get('name') or '').lower().split())
+    phone = re.sub(r'\D', '', str(record.get('phone') or ''))
+    return f'contact:{name}|{phone}'
+
+
+class CustomerKeyIndex(StoreIndex):
+    # Hash index from customer_key() to customer id, used to upsert imports
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._ids = {}
+
+    def rebuild(self, records):
+        self._ids = {customer_key(r): r['id'] for r in records}
+
+    def apply(self, op, record, old):
+        if old is not None and self._ids.get(customer_key(old)) == old['id']:
+            del self._ids[customer_key(old)]
+        if record is not None:
+            self._ids[customer_key(record)] = record['id']
+
+    def lookup_many(self, keys):
+        self.sync()
+        with self._lock:
+            return {key: self._ids[key] for key in keys if key in self._ids}
+
+
+def import_customers(store, key_index, chunks, progress=None):
+    # Upserts every chunk with two batch writes (inserts, updates). Incoming
+    # non-empty values overwrite existing ones; rows that change nothing or
+    # have no name are skipped. Returns inserted/updated/skipped counts, and
+    # reports them with the rows processed so far after each chunk.
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    mapping = None
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        if mapping is None:
+            mapping = resolve_columns(chunk.columns)
+        with metrics.span('import_build_chunk'):
+            records = build_customers(chunk, mapping)
+        counts['skipped'] += len(chunk) - len(records)
+
+        # Lookup and writes form one transaction, so a concurrent import
+        # can't insert the same customer between them
+        with store.transaction():
+            keys = [customer_key(r) for r in records]
+            existing_ids = key_index.lookup_many(keys)
+            existing = store.get_many(set(existing_ids.values()))
+            existing_ids = {key: i for key, i in existing_ids.items() if i in existing}
+            new_records = {}
+            changes = {}
+            for key, record in zip(keys, records):
+                if key in existing_ids:
+                    current = dict(existing[existing_ids[key]], **changes.get(existing_ids[key], {}))
+                elif key in new_records:
+                    current = new_records[key]
+                else:
+                    new_records[key] = record
+                    continue
+                fields = {f: record[f] for f in CUSTOMER_FIELDS if record[f] and record[f] != current.get(f)}
+                if not fields:
+                    counts['skipped'] += 1
+                elif key in existing_ids:
+                    changes.setdefault(existing_ids[key], {}).update(fields)
+                    counts['updated'] += 1
+                else:
+                    current.update(fields)
+                    counts['updated'] += 1
+            if new_records:
+                counts['inserted'] += len(store.insert_many(list(new_records.values())))
+            if changes:
+                updated_at = datetime.now().isoformat()
+                store.update_many([(i, dict(fields, updated_at=updated_at)) for i, fields in changes.items()])
+        if progress:
+            progress(rows=rows, **counts)
+    return counts
@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('done', 'failed')
+# Old finished jobs are pruned at most this often (seconds)
+PRUNE_INTERVAL = 3600
+
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def process_start_time(pid):
+    # Start time of a process in clock ticks since boot (Linux /proc), or
+    # None where that isn't available
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Fields after the parenthesised command name; starttime is field 22
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+
+def process_token(pid=None):
+    # Identifies a process rather than just its pid: after a restart a new
+    # worker often gets the same small pid as the one that ran a job
+    pid = pid or os.getpid()
+    return f'{pid}-{process_start_time(pid) or 0}'
+
+
+def owner_alive(token):
+    if not token:
+        return False
+    pid = int(token.split('-', 1)[0])
+    return pid_alive(pid) and process_token(pid) == token
+
+
+class JobQueue:
+    # Runs slow work (imports, exports) on a small in-process thread pool so
+    # the request can return straight away. Job state lives in a store, so
+    # any worker can answer status requests for a job another worker runs.
+    #
+    # Job functions are called as func(report_progress, *args, **kwargs) and
+    # return a JSON-serialisable result; report_progress(**fields) replaces
+    # the job's progress dict.
+    #
+    # Finished jobs are deleted `retention` after their last update, along
+    # with any result file under `files_dir`.
+
+    def __init__(self, store, max_workers=2, retention=timedelta(days=7), files_dir=None):
+        self.store = store
+        self.retention = retention
+        self.files_dir = os.path.abspath(files_dir) if files_dir else None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._pruned_at = 0
+        self._prune_lock = threading.Lock()
+        self._recover()
+        self.prune()
+
+    def _recover(self):
+        # Jobs whose worker process died can never finish
+        jobs, _ = self.store.query(filters=[('status', 'in', ACTIVE_STATUSES)])
+        for job in jobs:
+            if not owner_alive(job.get('owner')):
+                self._update(job['id'], status='failed', message='Interrupted before completion')
+
+    def prune(self):
+        # Deletes finished jobs older than the retention period; returns how many
+        with self._prune_lock:
+            self._pruned_at = time.monotonic()
+            cutoff = (datetime.now() - self.retention).isoformat()
+            with self.store.transaction():
+                jobs, _ = self.store.query(filters=[('status', 'in', FINISHED_STATUSES),
+                                                    ('updated_at', '<=', cutoff)])
+                for job in jobs:
+                    self.store.delete(job['id'])
+                # A cached result file can be shared with a newer job
+                kept = {self._result_file(job) for job in self.store.all()}
+            for path in {self._result_file(job) for job in jobs} - kept:
+                if path and self.files_dir and os.path.dirname(path) == self.files_dir:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            return len(jobs)
+
+    @staticmethod
+    def _result_file(job):
+        result = job.get('result')
+        return os.path.abspath(result['file']) if isinstance(result, dict) and result.get('file') else None
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        return self.store.update(job_id, fields)
+
+    def submit(self, kind, func, *args, user_id=None, **kwargs):
+        job = self.store.insert({
+            'kind': kind,
+            'status': 'queued',
+            'progress': {},
+            'message': '',
+            'result': None,
+            'user_id': user_id,
+            'owner': process_token(),
+            'created_at': datetime.now().isoformat()
+        })
+        self._executor.submit(self._run, job['id'], func, args, kwargs)
+        if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+            self._pruned_at = time.monotonic()
+            self._executor.submit(self.prune)
+        return job
+
+    def _run(self, job_id, func, args, kwargs):
+        self._update(job_id, status='running')
+        try:
+            result = func(functools.partial(self.report_progress, job_id), *args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status='failed', message=str(e))
+        else:
+            self._update(job_id, status='done', result=result)
+
+    def report_progress(self, job_id, **progress):
+        self._update(job_id, progress=progress)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
@@ -0,0 +1,254 @@
+import re
+
+import numpy as np
+
+from store import StoreIndex
+
+# Deposit dates are YYYY-MM-DD strings; the ledger keeps them as YYYYMMDD ints
+DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+COLUMNS = ('id', 'customer_id', 'amount', 'date')
+
+
+def date_key(value):
+    # YYYYMMDD int for a YYYY-MM-DD string (orders the same way), else None
+    match = DATE_RE.match(value) if isinstance(value, str) else None
+    return int(''.join(match.groups())) if match else None
+
+
+def format_date(key):
+    return f'{key // 10000:04d}-{key // 100 % 100:02d}-{key % 100:02d}'
+
+
+class DepositLedger(StoreIndex):
+    # Columnar copy of the deposit ledger for reporting: one NumPy array per
+    # column (id, customer_id, amount, date as YYYYMMDD) plus notes as
+    # indexes into a table of distinct strings. Filtering, sorting and
+    # totals run vectorized over the arrays instead of looping over dicts.
+    # Deleted rows are masked out and squeezed out once they make up half
+    # the arrays. Dates that aren't YYYY-MM-DD are kept aside as strings
+    # (and compare as missing); filters the ledger can't evaluate exactly
+    # are reported by supports() so callers can fall back to the store.
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._clear(0)
+
+    def _clear(self, capacity):
+        self._size = 0
+        self._dead = 0
+        self._ids = np.zeros(capacity, np.int64)
+        self._customer_ids = np.zeros(capacity, np.int64)
+        self._amounts = np.zeros(capacity, np.float64)
+        self._dates = np.zeros(capacity, np.int32)
+        self._notes = np.zeros(capacity, np.int32)
+        self._alive = np.zeros(capacity, bool)
+        # Rows are found by binary search while ids arrive in ascending order
+        # (the usual case); an out-of-order id switches to an id -> row dict
+        self._rows = None
+        self._odd_dates = {}  # row -> date string that isn't YYYY-MM-DD
+        self._strings = ['']
+        self._string_ids = {'': 0}
+
+    def rebuild(self, records):
+        self._clear(len(records))
+        for record in records:
+            self._append(record)
+
+    def apply(self, op, record, old):
+        try:
+            row = self._find(old['id']) if old is not None else None
+        except KeyError:
+            # Out of step with the store; rebuild on the next read
+            self.invalidate()
+            return
+        if row is not None and record is not None and old['id'] == record['id']:
+            self._set_row(row, record)
+            return
+        if row is not None:
+            if self._rows is not None:
+                del self._rows[old['id']]
+            self._alive[row] = False
+            self._odd_dates.pop(row, None)
+            self._dead += 1
+        if record is not None:
+            self._append(record)
+        if self._dead > 1024 and self._dead * 2 > self._size:
+            self._compact()
+
+    def _append(self, record):
+        if self._size == len(self._ids):
+            self._resize(max(1024, self._size * 2))
+        row = self._size
+        if self._rows is None and row and record['id'] <= self._ids[row - 1]:
+            alive = np.flatnonzero(self._alive[:row])
+            self._rows = dict(zip(self._ids[alive].tolist(), alive.tolist()))
+        if self._rows is not None:
+            self._rows[record['id']] = row
+        self._size += 1
+        self._set_row(row, record)
+
+    def _find(self, deposit_id):
+        if self._rows is not None:
+            return self._rows[deposit_id]
+        row = int(np.searchsorted(self._ids[:self._size], deposit_id))
+        if row == self._size or self._ids[row] != deposit_id or not self._alive[row]:
+            raise KeyError(deposit_id)
+        return row
+
+    def _set_row(self, row, record):
+        date = record.get('date') or ''
+        key = date_key(date)
+        self._odd_dates.pop(row, None)
+        if key is None and date:
+            self._odd_dates[row] = date
+        notes = record.get('notes') or ''
+        string_id = self._string_ids.get(notes)
+        if string_id is None:
+            string_id = self._string_ids[notes] = len(self._strings)
+            self._strings.append(notes)
+        self._ids[row] = record['id']
+        self._customer_ids[row] = record.get('customer_id') or 0
+        self._amounts[row] = record.get('amount') or 0
+        self._dates[row] = key or 0
+        self._notes[row] = string_id
+        self._alive[row] = True
+
+    def _resize(self, capacity):
+        for name in ('_ids', '_customer_ids', '_amounts', '_dates', '_notes', '_alive'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive[:self._size])
+        moved = {int(old): new for new, old in enumerate(keep)}
+        for name in ('_ids', '_customer_ids', '_amounts', '_dates', '_notes', '_alive'):
+            setattr(self, name, getattr(self, name)[keep].copy())
+        self._size = len(keep)
+        self._dead = 0
+        if self._rows is not None and np.all(np.diff(self._ids) > 0):
+            self._rows = None
+        elif self._rows is not None:
+            self._rows = dict(zip(self._ids.tolist(), range(self._size)))
+        self._odd_dates = {moved[row]: date for row, date in self._odd_dates.items()}
+        # Drop notes no row refers to any more; running iterators keep the old table
+        used = np.unique(self._notes)
+        strings = [self._strings[i] for i in used.tolist()]
+        self._notes = np.searchsorted(used, self._notes).astype(np.int32)
+        self._strings = strings
+        self._string_ids = {text: i for i, text in enumerate(strings)}
+
+    def _column(self, field):
+        return {'id': self._ids, 'customer_id': self._customer_ids,
+                'amount': self._amounts, 'date': self._dates}[field][:self._size]
+
+    @staticmethod
+    def supports(filters=(), sort='id', search=None):
+        # Filters on id, customer_id, amount and date (with YYYY-MM-DD values)
+        if search or sort.lstrip('-') not in COLUMNS:
+            return False
+        for field, op, value in filters:
+            if field not in COLUMNS or op not in ('==', '>', '>=', '<=', 'in'):
+                return False
+            if field == 'date' and (op == 'in' or date_key(value) is None):
+                return False
+        return True
+
+    def _mask(self, filters):
+        mask = self._alive[:self._size].copy()
+        for field, op, value in filters:
+            column = self._column(field)
+            if field == 'date':
+                # Rows without a YYYY-MM-DD date never match a date filter
+                value = date_key(value)
+                mask &= column != 0
+            if op == 'in':
+                mask &= np.isin(column, np.fromiter(value, np.float64 if field == 'amount' else np.int64))
+            elif op == '==':
+                mask &= column == value
+            elif op == '>':
+                mask &= column > value
+            elif op == '>=':
+                mask &= column >= value
+            else:
+                mask &= column <= value
+        return mask
+
+    def _select(self, filters, sort='id'):
+        # Matching rows in sort order; ties are broken by id in the same
+        # direction, like the stores do
+        rows = np.flatnonzero(self._mask(filters))
+        field = sort.lstrip('-')
+        ids = self._ids[rows]
+        if field == 'id':
+            order = np.argsort(ids, kind='stable')
+        else:
+            order = np.lexsort((ids, self._column(field)[rows]))
+        if sort.startswith('-'):
+            order = order[::-1]
+        return rows[order]
+
+    def _take(self, rows):
+        # Copies of the given rows' columns (a few dozen bytes a row), safe
+        # to turn into records after the lock is released
+        columns = (self._ids[rows], self._customer_ids[rows], self._amounts[rows],
+                   self._dates[rows], self._notes[rows])
+        odd_dates = {i: self._odd_dates[row] for i, row in enumerate(rows.tolist())
+                     if row in self._odd_dates}
+        return columns, odd_dates, self._strings
+
+    @staticmethod
+    def _records(taken, start=0, end=None):
+        columns, odd_dates, strings = taken
+        records = []
+        for i, (deposit_id, customer_id, amount, date, notes) in enumerate(
+                zip(*(column[start:end].tolist() for column in columns)), start):
+            records.append({'id': deposit_id, 'customer_id': customer_id, 'amount': amount,
+                            'date': odd_dates.get(i) or (format_date(date) if date else ''),
+                            'notes': strings[notes]})
+        return records
+
+    # Reads mirror the stores' query() and iter_batches(), returning just
+    # the reporting fields (id, customer_id, amount, date, notes)
+    def query(self, filters=(), search=None, sort='id', offset=0, limit=None, count=True):
+        if search:
+            raise ValueError('DepositLedger does not support text search')
+        self.sync()
+        with self._lock:
+            rows = self._select(filters, sort)
+            end = None if limit is None else offset + limit
+            taken = self._take(rows[offset:end])
+        return self._records(taken), len(rows) if count else None
+
+    def iter_batches(self, filters=(), batch_size=1000):
+        # The matching rows are copied up front, so writes made while a long
+        # export runs don't disturb it
+        self.sync()
+        with self._lock:
+            taken = self._take(self._select(filters))
+        for start in range(0, len(taken[0][0]), batch_size):
+            yield self._records(taken, start, start + batch_size)
+
+    def totals(self, by, filters=()):
+        # {key: {'count', 'total'}} grouped by 'customer', 'month' or 'day'
+        self.sync()
+        with self._lock:
+            mask = self._mask(filters)
+            if by == 'customer':
+                keys = self._customer_ids[:self._size][mask]
+            else:
+                dates = self._dates[:self._size][mask]
+                keys = dates // 100 if by == 'month' else dates
+            amounts = self._amounts[:self._size][mask]
+        unique, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(unique))
+        sums = np.bincount(inverse, weights=amounts, minlength=len(unique))
+        result = {}
+        for key, count, total in zip(unique.tolist(), counts.tolist(), sums.tolist()):
+            if by == 'month':
+                key = f'{key // 100:04d}-{key % 100:02d}' if key else ''
+            elif by == 'day':
+                key = format_date(key) if key else ''
+            result[key] = {'count': count, 'total': round(total, 2)}
+        return result
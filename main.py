@@ -1,93 +1,359 @@
 
 import os
-import json
-import pandas as pd
-import shutil
-from werkzeug.utils import secure_filename
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+import math
+import threading
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file, jsonify, Response, g, make_response, stream_template, get_flashed_messages, abort
 from functools import wraps
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from store import JournaledJsonStore, create_json_if_missing
+from storage import DATA_DIR, CUSTOMERS_FILE, DEPOSITS_FILE, USERS_FILE, open_store
+from search import CustomerSearchIndex
+import exports
+import importer
+from aggregates import CustomerDepositIndex, RecentRecords, DepositRollups, PeriodIndex
+from reports import ReportCache, PeriodReports, ReportScheduler, changed_records, match_period
+from jobs import JobQueue, ACTIVE_STATUSES
+import metrics
+import compression
+import fragments
+from jinja2 import FileSystemBytecodeCache
+import auth
+import assets
+import api
+import uuid
+import hashlib
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev_key_for_deposit_tracker')
 
+# Request timing for /metrics; requests slower than SLOW_REQUEST_SECONDS are logged
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '0')) or None
+# If set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics.init_app(app, slow_request_seconds=SLOW_REQUEST_SECONDS)
+# gzip for pages, CSV exports and JSON; set COMPRESS_RESPONSES=0 if a proxy
+# in front of the app already compresses
+if os.environ.get('COMPRESS_RESPONSES', '1') == '1':
+    compression.init_app(app, min_size=int(os.environ.get('COMPRESS_MIN_SIZE', '500')),
+                         level=int(os.environ.get('COMPRESS_LEVEL', '6')))
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if current_user() is None:
+            session.clear()
             flash('Please log in to access this page', 'error')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
-# Data storage paths
-DATA_DIR = 'data'
-CUSTOMERS_FILE = os.path.join(DATA_DIR, 'customers.json')
-DEPOSITS_FILE = os.path.join(DATA_DIR, 'deposits.json')
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+def admin_required(f):
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if current_user().get('role') != 'admin':
+            flash('You do not have permission to access this page', 'error')
+            return redirect(url_for('index'))
+        return f(*args, **kwargs)
+    return decorated_function
 
-# Create data directory if it doesn't exist
+def current_user():
+    # The cookie only carries a session token; the session and its user are
+    # checked against the server-side stores (cached per process) on every request
+    if 'user' not in g:
+        g.user = user_sessions.resolve(session.get('session_token'))
+        if g.user:
+            # Keep the copies templates read from the cookie in step with renames and role changes
+            for key, value in (('user_id', g.user['id']), ('username', g.user['username']),
+                               ('role', g.user.get('role', 'user'))):
+                if session.get(key) != value:
+                    session[key] = value
+    return g.user
+
+# Data storage paths (the stores' files are in storage.py)
+REPORTS_DIR = os.path.join(DATA_DIR, 'reports')
+SESSION_LIFETIME = timedelta(hours=int(os.environ.get('SESSION_LIFETIME_HOURS', '168')))
+UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')
+EXPORTS_DIR = os.path.join(DATA_DIR, 'exports')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Finished jobs, and cached exports nobody has downloaded, are deleted
+# after this many days
+JOB_RETENTION = timedelta(days=float(os.environ.get('JOB_RETENTION_DAYS', '7')))
+# Most customer reports an app process builds at once (see gunicorn.conf.py)
+EXCEL_WORKERS = int(os.environ.get('EXCEL_WORKERS', '2'))
+# Day/month workbooks and customer statements are pregenerated in the
+# background REPORT_SCHEDULE_DELAY seconds after deposits change, and every
+# REPORT_SCHEDULE_SECONDS regardless (0 turns the background thread off;
+# `flask pregenerate-reports` runs a round by hand or from cron)
+REPORT_SCHEDULE_SECONDS = float(os.environ.get('REPORT_SCHEDULE_SECONDS', '300'))
+REPORT_SCHEDULE_DELAY = float(os.environ.get('REPORT_SCHEDULE_DELAY', '10'))
+
+# Create data directories if they don't exist
 os.makedirs(DATA_DIR, exist_ok=True)
-
-# Initialize data files if they don't exist
-if not os.path.exists(CUSTOMERS_FILE):
-    with open(CUSTOMERS_FILE, 'w') as f:
-        json.dump([], f)
-
-if not os.path.exists(DEPOSITS_FILE):
-    with open(DEPOSITS_FILE, 'w') as f:
-        json.dump([], f)
-        
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+os.makedirs(EXPORTS_DIR, exist_ok=True)
+
+# Compiled templates are cached on disk, so fresh workers and serverless cold
+# starts load bytecode instead of parsing every template; run
+# `flask compile-templates` at deploy time to fill the cache ahead of traffic
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(DATA_DIR, 'template_cache'))
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+# {% cache %} blocks, see fragments.py
+app.jinja_env.add_extension(fragments.FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragments.FragmentCache()
+
+# Password KDF; the cost is part of the method string (see auth.py)
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', auth.DEFAULT_HASH_METHOD)
+passwords = auth.PasswordHasher(PASSWORD_HASH_METHOD)
+
+# Initialize data files if they don't exist. Safe to run in every worker at
+# once: an existing file is never touched, so this costs three stat() calls.
+create_json_if_missing(CUSTOMERS_FILE, [])
+create_json_if_missing(DEPOSITS_FILE, [])
 if not os.path.exists(USERS_FILE):
     # Create default admin user
     default_user = [{
         'id': 1,
         'username': 'admin',
         'email': 'admin@example.com',
-        'password': 'admin123',  # In a real app, this should be hashed
+        'password': passwords.hash('admin123'),
         'role': 'admin',
         'created_at': datetime.now().isoformat()
     }]
-    with open(USERS_FILE, 'w') as f:
-        json.dump(default_user, f, indent=2)
+    create_json_if_missing(USERS_FILE, default_user)
+
+customers_store = open_store('customers')
+deposits_store = open_store('deposits')
+users_store = open_store('users')
+jobs_store = open_store('jobs')
+sessions_store = open_store('sessions')
+
+STORES = {'customers': customers_store, 'deposits': deposits_store,
+          'users': users_store, 'jobs': jobs_store, 'sessions': sessions_store}
+
+# Users saved before passwords were hashed are converted once
+auth.hash_plaintext_passwords(users_store, passwords)
+
+# Derived indexes, kept in sync with the stores
+user_index = auth.UserIndex(users_store)
+user_sessions = auth.SessionManager(sessions_store, users_store, SESSION_LIFETIME)
+customer_index = CustomerSearchIndex(customers_store)
+customer_keys = importer.CustomerKeyIndex(customers_store)
+customer_deposits = CustomerDepositIndex(deposits_store)
+DASHBOARD_RECENT = 5
+recent_customers = RecentRecords(customers_store, size=DASHBOARD_RECENT)
+recent_deposits = RecentRecords(deposits_store, size=DASHBOARD_RECENT)
+deposit_rollups = DepositRollups(deposits_store)
+period_index = PeriodIndex(deposits_store)
+# DEPOSIT_LEDGER=1 keeps a columnar NumPy copy of the deposits that the
+# list, export and report pages read from (see ledger.py)
+DEPOSIT_LEDGER = os.environ.get('DEPOSIT_LEDGER', '0') == '1'
+deposit_ledger = None
+if DEPOSIT_LEDGER:
+    from ledger import DepositLedger
+    deposit_ledger = DepositLedger(deposits_store)
+report_cache = ReportCache(REPORTS_DIR)
+export_cache = ReportCache(EXPORTS_DIR, max_age=JOB_RETENTION.total_seconds())
+
+# Imports and exports run in the background; see /jobs/<id>
+job_queue = JobQueue(jobs_store, max_workers=JOB_WORKERS, retention=JOB_RETENTION, files_dir=EXPORTS_DIR)
+# Customer reports are built while the request waits, on a bounded pool so
+# that with threaded workers a burst of them can't take every thread's CPU
+report_pool = ThreadPoolExecutor(max_workers=EXCEL_WORKERS, thread_name_prefix='report')
+# pandas/openpyxl are loaded on first use; EXCEL_WARMUP=1 loads them in the
+# background right after startup instead, so the first import or export
+# doesn't pay for it and worker boot still doesn't wait for it
+if os.environ.get('EXCEL_WARMUP', '0') == '1':
+    threading.Thread(target=importer.warmup, daemon=True).start()
+SEARCH_LIMIT_DEFAULT = 10
+SEARCH_LIMIT_MAX = 50
 
 # Helper functions
+@metrics.timed('load_customers')
 def load_customers():
-    with open(CUSTOMERS_FILE, 'r') as f:
-        return json.load(f)
+    return customers_store.all()
 
+@metrics.timed('save_customers')
 def save_customers(customers):
-    with open(CUSTOMERS_FILE, 'w') as f:
-        json.dump(customers, f, indent=2)
+    customers_store.save(customers)
 
+@metrics.timed('load_deposits')
 def load_deposits():
-    with open(DEPOSITS_FILE, 'r') as f:
-        return json.load(f)
+    return deposits_store.all()
 
+@metrics.timed('save_deposits')
 def save_deposits(deposits):
-    with open(DEPOSITS_FILE, 'w') as f:
-        json.dump(deposits, f, indent=2)
+    deposits_store.save(deposits)
 
 def get_next_customer_id():
-    customers = load_customers()
-    return max([c.get('id', 0) for c in customers], default=0) + 1
+    return customers_store.next_id()
 
 def get_next_deposit_id():
-    deposits = load_deposits()
-    return max([d.get('id', 0) for d in deposits], default=0) + 1
+    return deposits_store.next_id()
 
+@metrics.timed('load_users')
 def load_users():
-    with open(USERS_FILE, 'r') as f:
-        return json.load(f)
+    return users_store.all()
 
+@metrics.timed('save_users')
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    users_store.save(users)
 
 def get_next_user_id():
-    users = load_users()
-    return max([u.get('id', 0) for u in users], default=0) + 1
+    return users_store.next_id()
+
+# List page helpers
+PER_PAGE_DEFAULT = 50
+PER_PAGE_MAX = 500
+CUSTOMER_SORT_FIELDS = ['id', 'name', 'phone', 'email', 'loan_number', 'address']
+DEPOSIT_SORT_FIELDS = ['id', 'date', 'customer_id', 'amount']
+CUSTOMER_SEARCH_FIELDS = ('name', 'phone', 'loan_number')
+DEPOSIT_FILTER_ARGS = ['date_from', 'date_to', 'amount_min', 'amount_max', 'customer_id', 'customer']
+
+def get_page_args(sort_fields, default_sort):
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', PER_PAGE_DEFAULT, type=int)
+    per_page = min(max(per_page, 1), PER_PAGE_MAX)
+    sort = request.args.get('sort', default_sort)
+    if sort.lstrip('-') not in sort_fields:
+        sort = default_sort
+    return page, per_page, sort
+
+def make_pagination(page, per_page, total):
+    pages = max((total + per_page - 1) // per_page, 1)
+    return {'page': page, 'per_page': per_page, 'total': total, 'pages': pages}
+
+def stream_page(template, **context):
+    # Sends the page while it renders instead of building it in memory.
+    # The session cookie goes out before the body, so flash messages are
+    # taken out of the session now (the template gets the same list).
+    get_flashed_messages()
+    return Response(compression.buffered(stream_template(template, **context)), mimetype='text/html')
+
+@app.template_global()
+def url_with_args(**updates):
+    # Current URL with some query parameters replaced (pagination/sort links).
+    # The query string is built here rather than by url_for, which would
+    # take arguments like ?endpoint= or ?_method= as its own parameters.
+    args = request.args.to_dict()
+    args.update(updates)
+    query = urlencode(args)
+    return url_for(request.endpoint, **request.view_args) + (f'?{query}' if query else '')
+
+# HTTP caching. Static files get a content fingerprint in their URL (?v=...)
+# and can then be cached for a year; pages carry an ETag built from the
+# versions of the stores they show, so an unchanged page costs a 304.
+STATIC_MAX_AGE = 365 * 24 * 3600
+# Static files linked with static_url(), fingerprinted in memory the same way
+# as the logo so rendering a page doesn't stat them
+STATIC_ASSETS = ['styles.css']
+static_registry = assets.AssetRegistry(app.static_folder, STATIC_ASSETS,
+                                       ttl=float(os.environ.get('ASSET_CHECK_SECONDS', '5')))
+
+@app.template_global()
+def static_url(filename):
+    version = static_registry.version(filename) if filename in STATIC_ASSETS else None
+    if version is None:
+        return url_for('static', filename=filename)
+    return url_for('static', filename=filename, v=version)
+
+@app.after_request
+def cache_static_files(response):
+    if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+def template_version():
+    # Changes when any template is edited, so a deploy invalidates cached pages
+    parts = []
+    for name in sorted(os.listdir(TEMPLATES_DIR)):
+        st = os.stat(os.path.join(TEMPLATES_DIR, name))
+        parts.append(f'{name}:{st.st_mtime_ns}:{st.st_size}')
+    return hashlib.blake2b('|'.join(parts).encode(), digest_size=8).hexdigest()
+
+TEMPLATES_DIR = os.path.join(app.root_path, app.template_folder)
+TEMPLATE_VERSION = template_version()
+
+# Uploaded logo, tracked in memory (see assets.AssetRegistry)
+LOGO_ASSET = 'logo.png'
+asset_registry = assets.AssetRegistry(os.path.join(app.static_folder, 'images'), [LOGO_ASSET],
+                                      ttl=float(os.environ.get('ASSET_CHECK_SECONDS', '5')))
+
+def logo_url():
+    version = asset_registry.version(LOGO_ASSET)
+    if version is None:
+        return None
+    return url_for('static', filename='images/' + LOGO_ASSET, v=version)
+
+@app.context_processor
+def inject_logo():
+    url = logo_url()
+    return {'logo_present': url is not None, 'logo_url': url}
+
+def page_etag(*parts):
+    # Everything a rendered page depends on besides the data: the URL, who
+    # is looking (nav shows the username/role), the logo, the stylesheet and
+    # the templates
+    key = [request.full_path, session.get('user_id'), session.get('username'), session.get('role'),
+           asset_registry.version(LOGO_ASSET), static_registry.version('styles.css'), TEMPLATE_VERSION, *parts]
+    return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def conditional_get(*stores):
+    # Answers 304 while none of the stores changed since the client's copy.
+    # Versions are read before rendering, so a write during the render just
+    # produces a new ETag on the next request. Pages with pending flash
+    # messages are always rendered.
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if session.get('_flashes'):
+                return f(*args, **kwargs)
+            etag = page_etag(*(store.version() for store in stores))
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+@app.template_global()
+def store_version(name):
+    # For fragment cache keys: {% cache 'name', store_version('customers') %}
+    return STORES[name].version()
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the bytecode cache."""
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    print(f'Compiled {len(names)} templates into {TEMPLATE_CACHE_DIR}')
+
+@app.cli.command('compact-deposits')
+def compact_deposits_command():
+    """Fold the deposit journal into deposits.json."""
+    if not isinstance(deposits_store, JournaledJsonStore):
+        print('Deposit journal is not enabled (set DEPOSITS_JOURNAL=1)')
+        return
+    folded = deposits_store.compact()
+    print(f'Compacted {folded} journal entries into {DEPOSITS_FILE}')
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -96,10 +362,14 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        users = load_users()
-        user = next((u for u in users if u.get('username') == username and u.get('password') == password), None)
+        user = user_index.get(username)
         
-        if user:
+        if user and passwords.verify(user.get('password'), password):
+            if passwords.needs_rehash(user['password']):
+                # Re-hash with the current cost (or a plaintext entry left by an older worker)
+                users_store.update(user['id'], {'password': passwords.hash(password)})
+            session.clear()
+            session['session_token'] = user_sessions.start(user)
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user.get('role', 'user')
@@ -108,11 +378,11 @@ def login():
         else:
             flash('Invalid username or password', 'error')
     
-    logo_present = os.path.exists('static/images/logo.png')
-    return render_template('login.html', logo_present=logo_present)
+    return render_template('login.html')
 
 @app.route('/logout')
 def logout():
+    user_sessions.end(session.get('session_token'))
     session.clear()
     flash('You have been logged out', 'success')
     return redirect(url_for('login'))
@@ -121,16 +391,67 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    customers = load_customers()
-    logo_present = os.path.exists('static/images/logo.png')
-    return render_template('index.html', customers=customers, logo_present=logo_present)
+    # The tables are cached fragments (see index.html), so their data is
+    # passed as callables and only looked up when a fragment is re-rendered
+    return render_template('index.html', summary=dashboard_totals(),
+                           recent_customers=recent_customers.recent,
+                           recent_deposits=recent_deposits_with_names,
+                           monthly_totals=lambda: deposit_rollups.months(12))
+
+def dashboard_totals():
+    # Everything here comes from incrementally maintained rollups
+    today = datetime.now().strftime('%Y-%m-%d')
+    return {
+        'customer_count': recent_customers.count(),
+        'deposits': deposit_rollups.totals(),
+        'today': dict(deposit_rollups.day(today), date=today),
+        'this_month': dict(deposit_rollups.month(today[:7]), month=today[:7]),
+    }
+
+def recent_deposits_with_names():
+    deposits = recent_deposits.recent()
+    customer_map = customers_store.get_many({d['customer_id'] for d in deposits})
+    for deposit in deposits:
+        customer = customer_map.get(deposit['customer_id'])
+        deposit['customer_name'] = customer['name'] if customer else 'Unknown'
+    return deposits
+
+def dashboard_summary():
+    return dict(dashboard_totals(),
+                recent_customers=recent_customers.recent(),
+                daily=deposit_rollups.days(30),
+                monthly=deposit_rollups.months(12),
+                recent_deposits=recent_deposits_with_names())
+
+@app.route('/api/dashboard')
+@login_required
+def dashboard_api():
+    return jsonify(dashboard_summary())
+
+@app.route('/api/store-locks')
+@login_required
+def store_locks_api():
+    # Write-lock wait times per store, for sizing the worker count
+    return jsonify({name: store.lock_stats.as_dict() for name, store in STORES.items()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    body = metrics.registry.render() + metrics.render_store_locks(STORES)
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 @app.route('/customers')
 @login_required
+@conditional_get(customers_store)
 def customer_list():
-    customers = load_customers()
-    logo_present = os.path.exists('static/images/logo.png')
-    return render_template('customers.html', customers=customers, logo_present=logo_present)
+    page, per_page, sort = get_page_args(CUSTOMER_SORT_FIELDS, 'id')
+    q = request.args.get('q', '').strip()
+    search = (CUSTOMER_SEARCH_FIELDS, q) if q else None
+    customers, total = customers_store.query(search=search, sort=sort,
+                                             offset=(page - 1) * per_page, limit=per_page)
+    return stream_page('customers.html', customers=customers,
+                       pagination=make_pagination(page, per_page, total), sort=sort, q=q)
 
 @app.route('/add_customer', methods=['GET', 'POST'])
 @login_required
@@ -146,9 +467,7 @@ def add_customer():
             flash('Customer name is required', 'error')
             return redirect(url_for('add_customer'))
         
-        customers = load_customers()
         new_customer = {
-            'id': get_next_customer_id(),
             'name': name,
             'phone': phone,
             'email': email,
@@ -156,8 +475,7 @@ def add_customer():
             'address': address,
             'created_at': datetime.now().isoformat()
         }
-        customers.append(new_customer)
-        save_customers(customers)
+        customers_store.insert(new_customer)
         
         flash('Customer added successfully', 'success')
         return redirect(url_for('customer_list'))
@@ -167,22 +485,22 @@ def add_customer():
 @app.route('/edit_customer/<int:customer_id>', methods=['GET', 'POST'])
 @login_required
 def edit_customer(customer_id):
-    customers = load_customers()
-    customer = next((c for c in customers if c.get('id') == customer_id), None)
+    customer = customers_store.get(customer_id)
     
     if not customer:
         flash('Customer not found', 'error')
         return redirect(url_for('customer_list'))
     
     if request.method == 'POST':
-        customer['name'] = request.form.get('name')
-        customer['phone'] = request.form.get('phone')
-        customer['email'] = request.form.get('email')
-        customer['loan_number'] = request.form.get('loan_number')
-        customer['address'] = request.form.get('address')
-        customer['updated_at'] = datetime.now().isoformat()
+        customers_store.update(customer_id, {
+            'name': request.form.get('name'),
+            'phone': request.form.get('phone'),
+            'email': request.form.get('email'),
+            'loan_number': request.form.get('loan_number'),
+            'address': request.form.get('address'),
+            'updated_at': datetime.now().isoformat()
+        })
         
-        save_customers(customers)
         flash('Customer updated successfully', 'success')
         return redirect(url_for('customer_list'))
     
@@ -191,136 +509,247 @@ def edit_customer(customer_id):
 @app.route('/delete_customer/<int:customer_id>', methods=['POST'])
 @login_required
 def delete_customer(customer_id):
-    customers = load_customers()
-    deposits = load_deposits()
-    
-    # Find the customer
-    customer = next((c for c in customers if c.get('id') == customer_id), None)
-    if not customer:
-        flash('Customer not found', 'error')
-        return redirect(url_for('customer_list'))
-    
-    # Check if customer has deposits
-    customer_deposits = [d for d in deposits if d.get('customer_id') == customer_id]
-    if customer_deposits:
-        flash('Cannot delete customer with existing deposits. Remove deposits first.', 'error')
-        return redirect(url_for('customer_list'))
-    
-    # Remove customer from list
-    customers = [c for c in customers if c.get('id') != customer_id]
-    save_customers(customers)
+    # Hold both stores so no deposit can be added between the check and the delete
+    with deposits_store.transaction(), customers_store.transaction():
+        # Find the customer
+        customer = customers_store.get(customer_id)
+        if not customer:
+            flash('Customer not found', 'error')
+            return redirect(url_for('customer_list'))
+        
+        # Check if customer has deposits
+        if customer_deposits.has_deposits(customer_id):
+            flash('Cannot delete customer with existing deposits. Remove deposits first.', 'error')
+            return redirect(url_for('customer_list'))
+        
+        # Remove customer from list
+        customers_store.delete(customer_id)
     
     flash('Customer deleted successfully', 'success')
     return redirect(url_for('customer_list'))
 
+def deposit_source(filters=(), sort='id'):
+    # The columnar ledger when it's enabled and can evaluate the query,
+    # otherwise the store; both have the same query()/iter_batches()
+    if deposit_ledger is not None and deposit_ledger.supports(filters, sort):
+        return deposit_ledger
+    return deposits_store
+
+def get_deposit_filters():
+    # Deposit filters from the query string, shared by the list and export
+    filters = []
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    amount_min = request.args.get('amount_min', type=float)
+    amount_max = request.args.get('amount_max', type=float)
+    customer_id = request.args.get('customer_id', type=int)
+    customer = request.args.get('customer', '').strip()
+    if date_from:
+        filters.append(('date', '>=', date_from))
+    if date_to:
+        filters.append(('date', '<=', date_to))
+    if amount_min is not None:
+        filters.append(('amount', '>=', amount_min))
+    if amount_max is not None:
+        filters.append(('amount', '<=', amount_max))
+    if customer_id:
+        filters.append(('customer_id', '==', customer_id))
+    if customer:
+        matches, _ = customers_store.query(search=(CUSTOMER_SEARCH_FIELDS, customer))
+        filters.append(('customer_id', 'in', {c['id'] for c in matches}))
+    return filters
+
 @app.route('/deposits')
 @login_required
+@conditional_get(deposits_store, customers_store)
 def deposit_list():
-    deposits = load_deposits()
-    customers = load_customers()
-    customer_map = {c['id']: c for c in customers}
-    
+    page, per_page, sort = get_page_args(DEPOSIT_SORT_FIELDS, '-id')
+    filters = get_deposit_filters()
+    deposits, total = deposit_source(filters, sort).query(filters, sort=sort,
+                                                          offset=(page - 1) * per_page, limit=per_page)
+    
+    # Only the customers shown on this page need to be looked up
+    customer_map = customers_store.get_many({d['customer_id'] for d in deposits})
+    
+    return stream_page('deposits.html', deposits=with_customer_names(deposits, customer_map),
+                       pagination=make_pagination(page, per_page, total), sort=sort,
+                       filters=request.args,
+                       export_args={k: request.args[k] for k in DEPOSIT_FILTER_ARGS if request.args.get(k)})
+
+def with_customer_names(deposits, customer_map):
+    # Each row gets its customer's name as the template reaches it; the
+    # loaded records are left as they are
     for deposit in deposits:
         customer = customer_map.get(deposit['customer_id'])
-        deposit['customer_name'] = customer['name'] if customer else 'Unknown'
-    
-    return render_template('deposits.html', deposits=deposits)
+        yield dict(deposit, customer_name=customer['name'] if customer else 'Unknown')
 
 @app.route('/add_deposit', methods=['GET', 'POST'])
 @login_required
 def add_deposit():
-    customers = load_customers()
     today = datetime.now().strftime('%Y-%m-%d')
     
     if request.method == 'POST':
-        customer_id = int(request.form.get('customer_id'))
-        amount = float(request.form.get('amount'))
+        customer_id = request.form.get('customer_id', type=int)
+        amount = request.form.get('amount', type=float)
         date = request.form.get('date')
         notes = request.form.get('notes', '')
         
-        if not customer_id or not amount or not date:
+        if not customer_id or not amount or not math.isfinite(amount) or not date:
             flash('Customer, amount, and date are required', 'error')
             return redirect(url_for('add_deposit'))
         
-        deposits = load_deposits()
         new_deposit = {
-            'id': get_next_deposit_id(),
             'customer_id': customer_id,
             'amount': amount,
             'date': date,
             'notes': notes,
             'created_at': datetime.now().isoformat()
         }
-        deposits.append(new_deposit)
-        save_deposits(deposits)
+        deposits_store.insert(new_deposit)
         
         flash('Deposit added successfully', 'success')
         return redirect(url_for('deposit_list'))
     
-    return render_template('add_deposit.html', customers=customers, today=today)
+    selected_customer = None
+    if request.args.get('customer_id', type=int):
+        selected_customer = customers_store.get(request.args.get('customer_id', type=int))
+    return render_template('add_deposit.html', selected_customer=selected_customer, today=today)
+
+@app.route('/api/customers/search')
+@login_required
+def customer_search():
+    q = request.args.get('q', '')
+    limit = request.args.get('limit', SEARCH_LIMIT_DEFAULT, type=int)
+    limit = min(max(limit, 1), SEARCH_LIMIT_MAX)
+    return jsonify({'results': customer_index.search(q, limit=limit)})
+
+# JSON API (list/get/create/update and batch deposit inserts), see api.py
+app.register_blueprint(api.create_blueprint(customers_store, deposits_store, current_user,
+                                            ledger=deposit_ledger))
 
 @app.route('/export_excel')
 @login_required
+@conditional_get(deposits_store, customers_store)
 def export_excel():
-    customers = load_customers()
-    deposits = load_deposits()
-    
-    # Create customer lookup
-    customer_map = {c['id']: c for c in customers}
-    
-    # Prepare data for export
-    export_data = []
-    for deposit in deposits:
-        customer = customer_map.get(deposit['customer_id'], {})
-        export_data.append({
-            'Deposit ID': deposit['id'],
-            'Date': deposit['date'],
-            'Customer Name': customer.get('name', 'Unknown'),
-            'Customer Phone': customer.get('phone', ''),
-            'Loan Number': customer.get('loan_number', ''),
-            'Amount': deposit['amount'],
-            'Notes': deposit['notes']
-        })
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(export_data)
-    
-    # Create an Excel file
-    export_file = os.path.join(DATA_DIR, 'deposit_report.xlsx')
-    df.to_excel(export_file, index=False, engine='openpyxl')
-    
-    return send_file(export_file, as_attachment=True, download_name=f'deposit_report_{datetime.now().strftime("%Y%m%d")}.xlsx')
+    filename = f'deposit_report_{datetime.now().strftime("%Y%m%d")}'
+    
+    if request.args.get('format') == 'csv':
+        # Rows are generated while joining deposits to customers, batch by batch
+        filters = get_deposit_filters()
+        rows = exports.iter_deposit_rows(deposit_source(filters), customers_store, filters)
+        return Response(exports.iter_csv(exports.DEPOSIT_EXPORT_COLUMNS, rows), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename={filename}.csv'})
+    
+    # A whole day or month comes from the pregenerated period reports
+    other_filters = [k for k in DEPOSIT_FILTER_ARGS if k not in ('date_from', 'date_to') and request.args.get(k)]
+    period = None if other_filters else match_period(request.args.get('date_from'), request.args.get('date_to'))
+    if period and not period_reports.available(*period):
+        period = None
+    if period and period_reports.cached(*period):
+        return redirect(url_for('period_report', kind=period[0], period=period[1]))
+    if period:
+        job = job_queue.submit('export', run_period_export_job, *period, user_id=session['user_id'])
+        return redirect(url_for('job_status', job_id=job['id']))
+    
+    # Workbooks are built by a background job; the job page links the file.
+    # The file is cached per filter set and data version, so repeating an
+    # export while nothing changed reuses it.
+    export_args = sorted((k, request.args[k]) for k in DEPOSIT_FILTER_ARGS if request.args.get(k))
+    cache_name = 'deposits_' + hashlib.blake2b(repr(export_args).encode(), digest_size=8).hexdigest()
+    cache_key = hashlib.blake2b(f'{deposits_store.version()}|{customers_store.version()}'.encode(),
+                                digest_size=8).hexdigest()
+    job = job_queue.submit('export', run_export_job, get_deposit_filters(), f'{filename}.xlsx',
+                           cache_name, cache_key, user_id=session['user_id'])
+    return redirect(url_for('job_status', job_id=job['id']))
+
+def build_customer_report(customer_id, report_key):
+    summary = customer_deposits.summary(customer_id)
+    
+    def build_report(path):
+        if deposit_ledger is not None:
+            batches = deposit_ledger.iter_batches([('customer_id', '==', customer_id)])
+            rows = exports.iter_customer_report_rows(d for batch in batches for d in batch)
+        else:
+            deposits = deposits_store.get_many(summary['deposit_ids'])
+            rows = exports.iter_customer_report_rows(deposits[i] for i in summary['deposit_ids'] if i in deposits)
+        with metrics.span('customer_report_xlsx'):
+            exports.save_xlsx(path, exports.CUSTOMER_REPORT_COLUMNS, rows)
+    
+    return report_cache.get_or_create(f'customer_{customer_id}', report_key, build_report)
+
+def build_period_report(path, filters):
+    rows = exports.iter_deposit_rows(deposit_source(filters), customers_store, filters)
+    with metrics.span('period_report_xlsx'):
+        exports.save_xlsx(path, exports.DEPOSIT_EXPORT_COLUMNS, rows)
+
+# Pregenerated reports (see REPORT_SCHEDULE_SECONDS). Only the day, month
+# and customer a deposit belongs to are rebuilt when it changes.
+period_reports = PeriodReports(report_cache, period_index, customers_store, build_period_report)
+statements_due = set()
+
+def queue_statements(op, record, old, previous, version):
+    statements_due.update(item['customer_id'] for item in changed_records(record, old))
+
+def pregenerate_statements():
+    while statements_due:
+        customer_id = statements_due.pop()
+        if customers_store.get(customer_id) and customer_deposits.has_deposits(customer_id):
+            build_customer_report(customer_id, customer_deposits.report_key(customer_id))
+
+deposits_store.subscribe(queue_statements)
+report_scheduler = ReportScheduler(os.path.join(REPORTS_DIR, '.scheduler.lock'),
+                                   interval=REPORT_SCHEDULE_SECONDS, delay=REPORT_SCHEDULE_DELAY)
+report_scheduler.add(period_reports.pregenerate)
+report_scheduler.add(pregenerate_statements)
+if REPORT_SCHEDULE_SECONDS > 0:
+    deposits_store.subscribe(report_scheduler.wake)
+    report_scheduler.start()
+
+@app.cli.command('pregenerate-reports')
+def pregenerate_reports_command():
+    """Build any missing day, month and customer reports now."""
+    statements_due.update(c['id'] for c in load_customers())
+    if not report_scheduler.run_once():
+        print('Another process is generating reports; try again later')
+        return
+    print('Reports are up to date')
+
+@app.route('/reports/<kind>/<period>.xlsx')
+@login_required
+def period_report(kind, period):
+    if not period_reports.available(kind, period):
+        abort(404)
+    path = period_reports.cached(kind, period) or \
+        report_pool.submit(period_reports.get_or_create, kind, period).result()
+    if path is None:
+        # Its last deposit was removed in the meantime
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=f'deposit_report_{period}.xlsx',
+                     mimetype=exports.XLSX_MIMETYPE)
 
 @app.route('/customer_report/<int:customer_id>')
 @login_required
 def customer_report(customer_id):
-    customers = load_customers()
-    deposits = load_deposits()
-    
-    customer = next((c for c in customers if c.get('id') == customer_id), None)
+    customer = customers_store.get(customer_id)
     if not customer:
         flash('Customer not found', 'error')
         return redirect(url_for('customer_list'))
     
-    customer_deposits = [d for d in deposits if d.get('customer_id') == customer_id]
-    
-    # Create customer report DataFrame
-    export_data = []
-    for deposit in customer_deposits:
-        export_data.append({
-            'Date': deposit['date'],
-            'Amount': deposit['amount'],
-            'Notes': deposit['notes']
-        })
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(export_data)
-    
-    # Create an Excel file
-    export_file = os.path.join(DATA_DIR, f'customer_{customer_id}_report.xlsx')
-    df.to_excel(export_file, index=False, engine='openpyxl')
-    
-    return send_file(export_file, as_attachment=True, download_name=f'customer_{customer["name"].replace(" ", "_")}_report.xlsx')
+    # Reports are cached on disk until one of the customer's deposits changes
+    report_key = customer_deposits.report_key(customer_id)
+    etag = page_etag(report_key, customer['name'])
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    report_name = f'customer_{customer_id}'
+    export_file = report_cache.cached(report_name, report_key) or \
+        report_pool.submit(build_customer_report, customer_id, report_key).result()
+    
+    response = send_file(export_file, as_attachment=True, download_name=f'customer_{customer["name"].replace(" ", "_")}_report.xlsx',
+                         etag=False)
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/import_customers', methods=['GET', 'POST'])
 @login_required
@@ -340,93 +769,124 @@ def import_customers():
             flash('Only CSV and Excel files are supported', 'error')
             return redirect(url_for('import_customers'))
         
-        try:
-            # Read the file
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            else:
-                df = pd.read_excel(file)
-            
-            # Validate the structure (must have at least a name column)
-            if 'name' not in df.columns and 'Name' not in df.columns:
-                flash('The file must contain a "name" or "Name" column', 'error')
-                return redirect(url_for('import_customers'))
-            
-            # Normalize column names
-            df.columns = [col.lower() for col in df.columns]
-            
-            # Load existing customers
-            customers = load_customers()
-            current_id = get_next_customer_id()
-            imported_count = 0
-            
-            # Process each row
-            for _, row in df.iterrows():
-                name = row.get('name', '')
-                if not name:
-                    continue
-                
-                new_customer = {
-                    'id': current_id,
-                    'name': name,
-                    'phone': str(row.get('phone', '')) if 'phone' in row else '',
-                    'email': row.get('email', '') if 'email' in row else '',
-                    'loan_number': str(row.get('loan_number', '')) if 'loan_number' in row else '',
-                    'address': row.get('address', '') if 'address' in row else '',
-                    'created_at': datetime.now().isoformat()
-                }
-                
-                customers.append(new_customer)
-                current_id += 1
-                imported_count += 1
-            
-            # Save the updated customer list
-            save_customers(customers)
-            
-            flash(f'Successfully imported {imported_count} customers', 'success')
-            return redirect(url_for('customer_list'))
-            
-        except Exception as e:
-            flash(f'Error importing customers: {str(e)}', 'error')
-            return redirect(url_for('import_customers'))
+        # Keep the upload on disk and import it in the background
+        extension = os.path.splitext(file.filename)[1].lower()
+        upload_path = os.path.join(UPLOADS_DIR, f'{uuid.uuid4().hex}{extension}')
+        file.save(upload_path)
+        job = job_queue.submit('import', run_import_job, upload_path, user_id=session['user_id'])
+        return redirect(url_for('job_status', job_id=job['id']))
     
     return render_template('import_customers.html')
 
+# Background jobs
+def run_import_job(report_progress, upload_path):
+    try:
+        # Read the file in bounded chunks and upsert each one
+        chunks = metrics.timed_iter('import_read_chunk', importer.iter_chunks(upload_path, upload_path))
+        with metrics.span('import_customers'):
+            return importer.import_customers(customers_store, customer_keys, chunks, progress=report_progress)
+    finally:
+        os.remove(upload_path)
+
+def run_export_job(report_progress, filters, download_name, cache_name, cache_key):
+    _, total = deposit_source(filters).query(filters, limit=0)
+    
+    def build_export(path):
+        rows = exports.iter_deposit_rows(deposit_source(filters), customers_store, filters)
+        
+        def counted_rows():
+            for count, row in enumerate(rows, 1):
+                if count % 5000 == 0:
+                    report_progress(rows=count, total=total)
+                yield row
+        
+        with metrics.span('export_xlsx'):
+            exports.save_xlsx(path, exports.DEPOSIT_EXPORT_COLUMNS, counted_rows())
+    
+    export_file = export_cache.get_or_create(cache_name, cache_key, build_export)
+    report_progress(rows=total, total=total)
+    return {'file': export_file, 'download_name': download_name, 'mimetype': exports.XLSX_MIMETYPE}
+
+def run_period_export_job(report_progress, kind, period):
+    path = period_reports.get_or_create(kind, period)
+    if path is None:
+        raise ValueError('There are no deposits in this period')
+    return {'file': path,
+            'download_name': f'deposit_report_{period}.xlsx', 'mimetype': exports.XLSX_MIMETYPE}
+
+def get_user_job(job_id):
+    job = job_queue.get(job_id)
+    if job and (job.get('user_id') == session.get('user_id') or session.get('role') == 'admin'):
+        return job
+    return None
+
+def job_summary(job):
+    summary = {k: job.get(k) for k in ('id', 'kind', 'status', 'progress', 'message', 'created_at', 'updated_at')}
+    result = job.get('result') or {}
+    if job['status'] == 'done' and 'file' in result:
+        summary['download_url'] = url_for('job_download', job_id=job['id'])
+    elif job['status'] == 'done':
+        summary['result'] = result
+    return summary
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = get_user_job(job_id)
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if not job:
+        if wants_json:
+            return jsonify({'error': 'Job not found'}), 404
+        flash('Job not found', 'error')
+        return redirect(url_for('index'))
+    
+    if wants_json:
+        return jsonify(job_summary(job))
+    return render_template('job_status.html', job=job_summary(job), active=job['status'] in ACTIVE_STATUSES)
+
+@app.route('/jobs/<int:job_id>/download')
+@login_required
+def job_download(job_id):
+    job = get_user_job(job_id)
+    result = (job or {}).get('result') or {}
+    if not job or job['status'] != 'done' or not os.path.exists(result.get('file', '')):
+        flash('Export file is not available', 'error')
+        return redirect(url_for('index'))
+    return send_file(result['file'], as_attachment=True, download_name=result['download_name'],
+                     mimetype=result['mimetype'])
+
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
-    logo_present = os.path.exists('static/images/logo.png')
-    
     if request.method == 'POST':
         if 'logo' in request.files:
             logo_file = request.files['logo']
             if logo_file.filename != '':
-                # Create static/images directory if it doesn't exist
-                os.makedirs('static/images', exist_ok=True)
-                
-                # Save the uploaded logo
-                filename = secure_filename('logo.png')
-                logo_path = os.path.join('static/images', filename)
-                logo_file.save(logo_path)
+                # Stored scaled down and optimized; the registry gives it a new versioned URL
+                try:
+                    data = assets.optimize_logo(logo_file.read())
+                except ValueError as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('settings'))
+                asset_registry.save(LOGO_ASSET, data)
                 flash('Logo uploaded successfully', 'success')
                 return redirect(url_for('settings'))
                 
         if 'remove_logo' in request.form:
-            if os.path.exists('static/images/logo.png'):
-                os.remove('static/images/logo.png')
+            if asset_registry.remove(LOGO_ASSET):
                 flash('Logo removed successfully', 'success')
                 return redirect(url_for('settings'))
                 
-    return render_template('settings.html', logo_present=logo_present)
+    return render_template('settings.html')
 
 @app.route('/users')
-@login_required
+@admin_required
 def user_list():
     users = load_users()
     return render_template('users.html', users=users)
 
 @app.route('/add_user', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def add_user():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -438,25 +898,23 @@ def add_user():
             flash('Username, email, and password are required', 'error')
             return redirect(url_for('add_user'))
         
-        users = load_users()
-        
-        # Check if username already exists
-        if any(user['username'] == username for user in users):
-            flash('Username already exists', 'error')
-            return redirect(url_for('add_user'))
-        
-        # Create new user
-        new_user = {
-            'id': get_next_user_id(),
-            'username': username,
-            'email': email,
-            'password': password,  # In a real app, you should hash this password
-            'role': role,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        users.append(new_user)
-        save_users(users)
+        # Check and insert in one transaction so two requests can't both add the name
+        with users_store.transaction():
+            # Check if username already exists
+            if user_index.taken(username):
+                flash('Username already exists', 'error')
+                return redirect(url_for('add_user'))
+            
+            # Create new user
+            new_user = {
+                'username': username,
+                'email': email,
+                'password': passwords.hash(password),
+                'role': role,
+                'created_at': datetime.now().isoformat()
+            }
+            
+            users_store.insert(new_user)
         
         flash('User added successfully', 'success')
         return redirect(url_for('user_list'))
@@ -464,10 +922,9 @@ def add_user():
     return render_template('add_user.html')
 
 @app.route('/edit_user/<int:user_id>', methods=['GET', 'POST'])
-@login_required
+@admin_required
 def edit_user(user_id):
-    users = load_users()
-    user = next((u for u in users if u.get('id') == user_id), None)
+    user = users_store.get(user_id)
     
     if not user:
         flash('User not found', 'error')
@@ -483,39 +940,37 @@ def edit_user(user_id):
             flash('Username and email are required', 'error')
             return redirect(url_for('edit_user', user_id=user_id))
         
-        # Check if username already exists (excluding current user)
-        if any(u['username'] == username and u['id'] != user_id for u in users):
-            flash('Username already exists', 'error')
-            return redirect(url_for('edit_user', user_id=user_id))
-        
-        # Update user
-        user['username'] = username
-        user['email'] = email
-        if password:  # Only update password if provided
-            user['password'] = password  # In a real app, you should hash this password
-        user['role'] = role
-        user['updated_at'] = datetime.now().isoformat()
-        
-        save_users(users)
+        with users_store.transaction():
+            # Check if username already exists (excluding current user)
+            if user_index.taken(username, user_id):
+                flash('Username already exists', 'error')
+                return redirect(url_for('edit_user', user_id=user_id))
+            
+            # Update user
+            changes = {
+                'username': username,
+                'email': email,
+                'role': role,
+                'updated_at': datetime.now().isoformat()
+            }
+            if password:  # Only update password if provided
+                changes['password'] = passwords.hash(password)
+            if users_store.update(user_id, changes) is None:
+                flash('User not found', 'error')
+                return redirect(url_for('user_list'))
         flash('User updated successfully', 'success')
         return redirect(url_for('user_list'))
     
     return render_template('edit_user.html', user=user)
 
 @app.route('/delete_user/<int:user_id>', methods=['POST'])
-@login_required
+@admin_required
 def delete_user(user_id):
-    users = load_users()
-    
-    # Find the user
-    user = next((u for u in users if u.get('id') == user_id), None)
-    if not user:
+    # Remove user from list (delete reports whether the user existed)
+    if not users_store.delete(user_id):
         flash('User not found', 'error')
         return redirect(url_for('user_list'))
-    
-    # Remove user from list
-    users = [u for u in users if u.get('id') != user_id]
-    save_users(users)
+    user_sessions.end_user(user_id)
     
     flash('User deleted successfully', 'success')
     return redirect(url_for('user_list'))
@@ -0,0 +1,193 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request, before_render_template, template_rendered
+
+# In-process metrics in the Prometheus text format. Each gunicorn worker
+# keeps and reports its own numbers; scrape every worker (or sum them) to
+# see the whole server.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name):
+        # Times a block of hot-path work (file loads, saves, pandas calls)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('span_duration_seconds', time.perf_counter() - started, span=name)
+
+    def timed(self, name):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, name, iterable):
+        # Times each step of a lazy iterator (e.g. pandas reading chunks)
+        iterator = iter(iterable)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h.counts), h.count, h.sum, h.buckets)
+                                for key, h in self._histograms.items())
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), counts, count, total, buckets in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'Requests handled, by endpoint, method and status.')
+registry.describe('http_request_duration_seconds', 'Request latency by endpoint and method.')
+registry.describe('span_duration_seconds', 'Time spent in instrumented hot-path code.')
+registry.describe('template_render_seconds', 'Time spent rendering each template.')
+span = registry.span
+timed = registry.timed
+timed_iter = registry.timed_iter
+
+
+def render_store_locks(stores):
+    # Lock wait metrics (see store.LockStats), one series per store
+    lines = [
+        '# HELP store_lock_acquired_total Write transactions started.',
+        '# TYPE store_lock_acquired_total counter',
+    ]
+    stats = {name: store.lock_stats.as_dict() for name, store in stores.items()}
+    for name, s in stats.items():
+        lines.append(f'store_lock_acquired_total{{store="{name}"}} {s["acquired"]}')
+    lines += ['# HELP store_lock_wait_seconds_total Time spent waiting for write locks.',
+              '# TYPE store_lock_wait_seconds_total counter']
+    for name, s in stats.items():
+        lines.append(f'store_lock_wait_seconds_total{{store="{name}"}} {s["wait_seconds_total"]}')
+    lines += ['# HELP store_lock_wait_seconds_max Longest single wait for a write lock.',
+              '# TYPE store_lock_wait_seconds_max gauge']
+    for name, s in stats.items():
+        lines.append(f'store_lock_wait_seconds_max{{store="{name}"}} {s["wait_seconds_max"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app, slow_request_seconds=None):
+    # Times every request and every template render. Requests slower than
+    # slow_request_seconds (if set) are logged with their path and status.
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        # Unmatched URLs share one label so 404 scans can't blow up the series count
+        endpoint = request.endpoint or 'unmatched'
+        method, path, status = request.method, request.full_path.rstrip('?'), response.status_code
+
+        def record():
+            elapsed = time.perf_counter() - started
+            registry.inc('http_requests_total', endpoint=endpoint, method=method, status=status)
+            registry.observe('http_request_duration_seconds', elapsed, endpoint=endpoint, method=method)
+            if slow_request_seconds and elapsed >= slow_request_seconds:
+                app.logger.warning('Slow request: %s %s -> %s in %.3fs', method, path, status, elapsed)
+
+        # A streamed page renders while it is sent, so it is timed until the
+        # server closes the response rather than until the headers go out
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+        return response
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        started = g.get('metrics_templates')
+        if started:
+            registry.observe('template_render_seconds', time.perf_counter() - started.pop(),
+                             template=template.name)
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
@@ -0,0 +1,255 @@
+import os
+import glob
+import time
+import fcntl
+import logging
+import calendar
+import tempfile
+import threading
+from datetime import datetime
+
+from aggregates import record_digest
+
+logger = logging.getLogger(__name__)
+
+PERIOD_KINDS = ('day', 'month')
+
+
+class ReportCache:
+    # Generated report files kept on disk under a name plus a content key.
+    # A report is only rebuilt when its key changes; files are written to a
+    # temp name and renamed into place, so concurrent requests never see
+    # (or clobber) a half-written file.
+    #
+    # With max_age (seconds), reports nobody has asked for in that long are
+    # deleted; a hit refreshes the file's mtime.
+
+    def __init__(self, directory, max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._building = {}
+        self._building_lock = threading.Lock()
+        self._pruned_at = 0
+
+    def path_for(self, name, key, ext='xlsx'):
+        return os.path.abspath(os.path.join(self.directory, f'{name}_{key}.{ext}'))
+
+    def cached(self, name, key, ext='xlsx'):
+        # Path of an already built report, or None
+        path = self.path_for(name, key, ext)
+        return path if self._hit(path) else None
+
+    def _hit(self, path):
+        if not self.max_age:
+            return os.path.exists(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def get_or_create(self, name, key, build, ext='xlsx'):
+        path = self.path_for(name, key, ext)
+        if self._hit(path):
+            return path
+        # Threads asking for the same report wait for one build
+        with self._building_lock:
+            lock = self._building.setdefault(path, threading.Lock())
+        with lock:
+            try:
+                if os.path.exists(path):
+                    return path
+                return self._create(name, path, build, ext)
+            finally:
+                with self._building_lock:
+                    if self._building.get(path) is lock:
+                        del self._building[path]
+
+    def _create(self, name, path, build, ext):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix=f'.{ext}')
+        os.close(fd)
+        try:
+            build(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.discard(name, keep=path, ext=ext)
+        if self.max_age and time.monotonic() - self._pruned_at > min(self.max_age, 3600):
+            self.prune()
+        return path
+
+    def prune(self):
+        # Remove reports not used for max_age seconds
+        self._pruned_at = time.monotonic()
+        cutoff = time.time() - self.max_age
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, name, keep=None, ext='xlsx'):
+        # Remove older versions of a report
+        for old_path in glob.glob(os.path.join(glob.escape(self.directory), f'{name}_*.{ext}')):
+            if os.path.abspath(old_path) != keep:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+
+def changed_records(record, old):
+    # The records a store change touched, before and after (see store.py)
+    for item in (record if isinstance(record, list) else [record]) + \
+            (old if isinstance(old, list) else [old]):
+        if item is not None:
+            yield item
+
+
+def period_range(kind, period):
+    # First and last YYYY-MM-DD date of a day or month, or None if invalid
+    try:
+        if kind == 'day':
+            datetime.strptime(period, '%Y-%m-%d')
+            return period, period
+        if kind == 'month':
+            start = datetime.strptime(period, '%Y-%m')
+            return f'{period}-01', f'{period}-{calendar.monthrange(start.year, start.month)[1]:02d}'
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def match_period(date_from, date_to):
+    # (kind, period) if the date range is exactly one day or one month
+    if date_from and date_from == date_to and period_range('day', date_from):
+        return 'day', date_from
+    month = (date_from or '')[:7]
+    if period_range('month', month) == (date_from, date_to):
+        return 'month', month
+    return None
+
+
+class PeriodReports:
+    # Deposit workbooks for single days and months, kept in a ReportCache
+    # under a key built from the period's deposits (aggregates.PeriodIndex)
+    # and their customers, so a new or edited deposit only invalidates its
+    # own day and month. Periods touched by this process's writes are
+    # queued for pregenerate(), which also checks the most recent periods
+    # and so picks up writes from other workers.
+    #
+    # build(path, filters) writes the workbook for the deposits matching
+    # the filters.
+
+    def __init__(self, cache, index, customers_store, build, recent_days=7, recent_months=2):
+        self.cache = cache
+        self.index = index
+        self.customers_store = customers_store
+        self.build = build
+        self.recent_days = recent_days
+        self.recent_months = recent_months
+        self._due = set()
+        self._lock = threading.Lock()
+        index.store.subscribe(self._on_change)
+
+    def _on_change(self, op, record, old, previous, version):
+        dates = {item.get('date') or '' for item in changed_records(record, old)}
+        with self._lock:
+            for date in dates:
+                self._due.update({('day', date), ('month', date[:7])})
+
+    def filters(self, kind, period):
+        first, last = period_range(kind, period)
+        return [('date', '>=', first), ('date', '<=', last)]
+
+    def key(self, kind, period):
+        summary = self.index.summary(kind, period)
+        customer_digest = 0
+        for customer in self.customers_store.get_many(summary['customer_ids']).values():
+            customer_digest ^= record_digest(customer)
+        return f"{summary['count']}-{summary['digest']:016x}-{customer_digest:016x}"
+
+    def available(self, kind, period):
+        # Only periods with deposits get a report, so walking through dates
+        # can't fill the disk with empty workbooks
+        return period_range(kind, period) is not None and self.index.summary(kind, period)['count'] > 0
+
+    def cached(self, kind, period):
+        return self.cache.cached(f'{kind}_{period}', self.key(kind, period))
+
+    def get_or_create(self, kind, period):
+        # Path of the period's workbook, or None if it has no deposits (any
+        # workbook left from before its last deposit went is removed)
+        if not self.available(kind, period):
+            if period_range(kind, period):
+                self.cache.discard(f'{kind}_{period}')
+            return None
+        filters = self.filters(kind, period)
+        return self.cache.get_or_create(f'{kind}_{period}', self.key(kind, period),
+                                        lambda path: self.build(path, filters))
+
+    def pregenerate(self):
+        with self._lock:
+            due, self._due = self._due, set()
+        due.update(('day', day) for day in self.index.periods('day')[-self.recent_days:])
+        due.update(('month', month) for month in self.index.periods('month')[-self.recent_months:])
+        for kind, period in sorted(due):
+            self.get_or_create(kind, period)
+        return len(due)
+
+
+class ReportScheduler:
+    # Runs report pregeneration tasks on a background thread: `delay`
+    # seconds after wake() (so a burst of writes is handled once) and at
+    # least every `interval` seconds. A lock file makes sure only one
+    # process runs a round at a time; the others skip it.
+
+    def __init__(self, lock_path, interval=300, delay=10):
+        self.lock_path = lock_path
+        self.interval = interval
+        self.delay = delay
+        self.tasks = []
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, task):
+        self.tasks.append(task)
+
+    def wake(self, *args):
+        # Usable directly as a store listener
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='report-scheduler', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            if self._wake.wait(self.interval):
+                time.sleep(self.delay)
+            self._wake.clear()
+            self.run_once()
+
+    def run_once(self):
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                for task in self.tasks:
+                    try:
+                        task()
+                    except Exception:
+                        logger.exception('Report pregeneration failed in %s', getattr(task, '__name__', task))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
@@ -0,0 +1,115 @@
+import bisect
+import heapq
+from collections import defaultdict
+
+from store import StoreIndex
+
+
+def normalize(value):
+    return str(value or '').strip().lower()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CustomerSearchIndex(StoreIndex):
+    # Substring search over customer name, phone and loan number.
+    # Queries of three or more characters go through a trigram index;
+    # shorter ones use a sorted list of words for prefix lookups.
+
+    FIELDS = ('name', 'phone', 'loan_number')
+
+    def __init__(self, store):
+        super().__init__(store)
+        self._grams = defaultdict(set)
+        self._words = []
+        self._terms = {}
+        self._summaries = {}
+
+    def rebuild(self, records):
+        self._grams = defaultdict(set)
+        self._words = []
+        self._terms = {}
+        self._summaries = {}
+        for record in records:
+            self._add(record, sort_words=False)
+        self._words.sort()
+
+    def apply(self, op, record, old):
+        if old is not None:
+            self._remove(old['id'])
+        if record is not None:
+            self._add(record)
+
+    def _add(self, record, sort_words=True):
+        customer_id = record['id']
+        terms = tuple(normalize(record.get(field)) for field in self.FIELDS)
+        self._terms[customer_id] = terms
+        self._summaries[customer_id] = {
+            'id': customer_id,
+            'name': record.get('name') or '',
+            'phone': record.get('phone') or '',
+            'loan_number': record.get('loan_number') or '',
+        }
+        for term in terms:
+            for gram in trigrams(term):
+                self._grams[gram].add(customer_id)
+            for word in term.split():
+                if sort_words:
+                    bisect.insort(self._words, (word, customer_id))
+                else:
+                    self._words.append((word, customer_id))
+
+    def _remove(self, customer_id):
+        terms = self._terms.pop(customer_id, None)
+        self._summaries.pop(customer_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            for gram in trigrams(term):
+                ids = self._grams.get(gram)
+                if ids is not None:
+                    ids.discard(customer_id)
+                    if not ids:
+                        del self._grams[gram]
+            for word in term.split():
+                i = bisect.bisect_left(self._words, (word, customer_id))
+                if i < len(self._words) and self._words[i] == (word, customer_id):
+                    del self._words[i]
+
+    def _candidates(self, q):
+        if len(q) >= 3:
+            sets = [self._grams.get(gram) for gram in trigrams(q)]
+            if not all(sets):
+                return set()
+            sets.sort(key=len)
+            ids = set(sets[0]).intersection(*sets[1:])
+            return {i for i in ids if any(q in term for term in self._terms[i])}
+        ids = set()
+        i = bisect.bisect_left(self._words, (q,))
+        while i < len(self._words) and self._words[i][0].startswith(q):
+            ids.add(self._words[i][1])
+            i += 1
+        return ids
+
+    def search(self, q, limit=10):
+        q = normalize(q)
+        if not q:
+            return []
+        self.sync()
+        with self._lock:
+            ids = self._candidates(q)
+
+            # Name prefix matches first, then any field prefix, then the rest
+            def rank(customer_id):
+                terms = self._terms[customer_id]
+                if terms[0].startswith(q):
+                    score = 0
+                elif any(term.startswith(q) for term in terms):
+                    score = 1
+                else:
+                    score = 2
+                return (score, terms[0], customer_id)
+
+            return [dict(self._summaries[i]) for i in heapq.nsmallest(limit, ids, key=rank)]
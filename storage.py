@@ -0,0 +1,49 @@
+import os
+
+from store import JsonStore, JournaledJsonStore, SqliteStore
+
+# Where the data lives and which store backend holds it. Shared by the web
+# app and the command-line scripts, which open just the stores they need
+# without starting the app.
+
+# Data storage paths
+DATA_DIR = 'data'
+CUSTOMERS_FILE = os.path.join(DATA_DIR, 'customers.json')
+DEPOSITS_FILE = os.path.join(DATA_DIR, 'deposits.json')
+USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+DEPOSITS_JOURNAL_FILE = os.path.join(DATA_DIR, 'deposits.journal.jsonl')
+JOBS_FILE = os.path.join(DATA_DIR, 'jobs.json')
+SESSIONS_FILE = os.path.join(DATA_DIR, 'sessions.json')
+
+# Storage backend: 'json' (default) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+DATABASE_FILE = os.path.join(DATA_DIR, 'deposit_tracker.db')
+# With the JSON backend, deposits can be kept as snapshot + append-only journal
+DEPOSITS_JOURNAL = os.environ.get('DEPOSITS_JOURNAL', '0') == '1'
+DEPOSITS_COMPACT_THRESHOLD = int(os.environ.get('DEPOSITS_COMPACT_THRESHOLD', '10000'))
+
+STORE_FILES = {'customers': CUSTOMERS_FILE, 'deposits': DEPOSITS_FILE, 'users': USERS_FILE,
+               'jobs': JOBS_FILE, 'sessions': SESSIONS_FILE}
+# Columns the SQLite tables index, and the stores migrated from JSON
+SQLITE_INDEXED = {'customers': ['loan_number'], 'deposits': ['customer_id', 'date'],
+                  'users': ['username'], 'jobs': ['status'], 'sessions': ['token', 'user_id']}
+SQLITE_MIGRATED = ('customers', 'deposits', 'users')
+
+
+def open_store(name):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    if STORAGE_BACKEND == 'sqlite':
+        store = SqliteStore(DATABASE_FILE, name, indexed=SQLITE_INDEXED[name])
+        # Migrate the existing JSON files the first time the database is used
+        # (the journal only needs folding in while the table is still empty)
+        if (name == 'deposits' and os.path.exists(DEPOSITS_JOURNAL_FILE)
+                and os.path.getsize(DEPOSITS_JOURNAL_FILE) and not store.count()):
+            JournaledJsonStore(DEPOSITS_FILE, DEPOSITS_JOURNAL_FILE).compact()
+        if name in SQLITE_MIGRATED:
+            store.import_json(STORE_FILES[name])
+        return store
+    # In-process stores (parsed data is cached and reloaded when the file changes)
+    if name == 'deposits' and DEPOSITS_JOURNAL:
+        return JournaledJsonStore(DEPOSITS_FILE, DEPOSITS_JOURNAL_FILE,
+                                  compact_threshold=DEPOSITS_COMPACT_THRESHOLD)
+    return JsonStore(STORE_FILES[name])
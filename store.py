@@ -0,0 +1,963 @@
+import os
+import json
+import fcntl
+import sqlite3
+import time
+import bisect
+import logging
+import tempfile
+import threading
+import itertools
+from contextlib import contextmanager
+
+# The store classes expose the same interface (all/get/get_many/count/
+# next_id/query/iter_batches/save/insert/insert_many/update/update_many/
+# delete/transaction/version/snapshot/subscribe) so main.py can switch
+# backends freely.
+#
+# version() is a token that changes whenever the data changes, in this or
+# any other worker. Listeners registered with subscribe() are called after
+# every write as callback(op, record, old, previous_version, version), with
+# op one of 'insert', 'update', 'delete', 'insert_many'/'update_many'
+# (record and old are then lists) or 'reset' (bulk save).
+#
+# transaction() wraps a read-modify-write sequence: nothing else can write
+# the store until the block ends, and listeners only hear about changes
+# once they are committed. lock_stats records how long writers waited.
+#
+# query() filters are (field, op, value) tuples with op one of '==', '>',
+# '>=', '<=' or 'in'; search is a (fields, text) pair matched case-insensitively
+# as a substring of any of the fields; sort is a field name, prefixed with
+# '-' for descending order. With count=False the total isn't computed
+# (None is returned instead), so a page only reads as far as its last row.
+
+logger = logging.getLogger(__name__)
+
+# Lock waits at least this long (seconds) are logged
+LOCK_WAIT_WARNING = 1.0
+
+FILTER_OPS = {
+    '==': lambda a, b: a == b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<=': lambda a, b: a is not None and a <= b,
+    'in': lambda a, b: a in b,
+}
+
+
+def sort_key(value):
+    # Orders values of mixed types instead of raising TypeError (legacy
+    # records can hold an int or NaN where a string is expected): numbers
+    # first, then everything else by its text, missing values last
+    if value is None or value != value:
+        return (2, 0, '')
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, '')
+    return (1, 0, str(value))
+
+
+def record_matches(record, filters=(), search=None):
+    for field, op, value in filters:
+        if not FILTER_OPS[op](record.get(field), value):
+            return False
+    if search:
+        fields, text = search
+        text = text.lower()
+        return any(text in str(record.get(f) or '').lower() for f in fields)
+    return True
+
+
+def _write_temp_json(path, data):
+    # Written and fsynced next to path, ready to be renamed or linked into place
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def atomic_write_json(path, data):
+    tmp_path = _write_temp_json(path, data)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def create_json_if_missing(path, data):
+    # Idempotent initialisation: link() fails if the file exists, so a
+    # worker starting late can't overwrite a file another worker has
+    # already created (and possibly written to since)
+    if os.path.exists(path):
+        return False
+    tmp_path = _write_temp_json(path, data)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    except OSError:
+        # No hard links on this filesystem
+        return _create_exclusive(path, data)
+    finally:
+        os.remove(tmp_path)
+
+
+def _create_exclusive(path, data):
+    # O_EXCL still stops two workers both creating the file. Unlike link(),
+    # the file is visible before it is written, so a worker reading it at
+    # that moment can see it empty.
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+class LockStats:
+    # How long writers waited for a store's write lock. Long or growing
+    # waits mean workers are queueing on the same file.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited):
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        if waited >= LOCK_WAIT_WARNING:
+            logger.warning('Waited %.2fs for a store write lock', waited)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+            }
+
+
+class JsonStore:
+    # Keeps the parsed contents of a JSON list file in memory and only
+    # re-reads it when the file on disk changes (mtime/size/inode), so
+    # several gunicorn workers sharing the same data directory stay coherent.
+    #
+    # Every write runs inside transaction(): an exclusive flock on a lock
+    # file next to the data, a reload if another worker wrote in the
+    # meantime, then write-temp + os.replace so readers (which take no
+    # lock) never see a half-written file.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.lock_stats = LockStats()
+        self._lock = threading.RLock()
+        self._records = []
+        self._by_id = {}
+        self._max_id = 0
+        self._in_id_order = True
+        self._signature = None
+        self._sorted = {}
+        self._listeners = []
+        self._depth = 0
+        self._dirty = False
+        self._pending = []
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _set_records(self, records):
+        self._records = records
+        self._sorted = {}
+        self._by_id = {r.get('id'): r for r in records}
+        self._max_id = max((r.get('id', 0) for r in records), default=0)
+        self._in_id_order = all(a.get('id', 0) < b.get('id', 0) for a, b in zip(records, records[1:]))
+
+    def _load(self):
+        signature = self._file_signature()
+        if signature is None:
+            records = []
+        else:
+            with open(self.path, 'r') as f:
+                records = json.load(f)
+        self._set_records(records)
+        self._signature = signature
+
+    def _refresh(self):
+        # Inside a transaction the file is ours and the cache holds
+        # changes not yet written, so there is nothing to reload
+        if self._depth:
+            return
+        self._refresh_locked()
+
+    def _refresh_locked(self):
+        signature = self._file_signature()
+        if signature is not None and signature == self._signature:
+            return
+        self._load()
+
+    @contextmanager
+    def _file_lock(self, mode):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def transaction(self):
+        # Read-modify-write unit. Reads inside the block see the latest
+        # data and no other thread or worker can write until it ends; all
+        # changes are persisted together when the outermost block exits,
+        # or dropped if it raises. The write helpers open one themselves,
+        # so they join the caller's transaction when nested.
+        started = time.perf_counter()
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+            with self._file_lock(fcntl.LOCK_EX):
+                self.lock_stats.record(time.perf_counter() - started)
+                self._refresh_locked()
+                previous = self._version_token()
+                self._depth = 1
+                try:
+                    yield self
+                    if self._dirty:
+                        self._commit()
+                except BaseException:
+                    self._rollback()
+                    raise
+                finally:
+                    self._depth = 0
+                    pending, self._pending, self._dirty = self._pending, [], False
+            self._notify(pending, previous)
+
+    def _commit(self):
+        atomic_write_json(self.path, self._records)
+        self._signature = self._file_signature()
+
+    def _rollback(self):
+        # Forces a reload from disk, dropping the uncommitted changes; a
+        # transaction that changed nothing leaves the cache as it is
+        if self._dirty:
+            self._signature = None
+
+    def _changed(self, op, record, old, entries=()):
+        self._dirty = True
+        self._pending.append((op, record, old))
+
+    def _version_token(self):
+        token = '-'.join(str(part) for part in self._signature or ())
+        # Uncommitted changes must never pass for the committed version
+        return token + '-uncommitted' if self._dirty else token
+
+    def _notify(self, pending, previous):
+        # Every change of a transaction ends at the same version, so each
+        # one after the first follows on from it
+        version = self._version_token()
+        for op, record, old in pending:
+            for callback in self._listeners:
+                callback(op, record, old, previous, version)
+            previous = version
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    # Cache-only mutations, shared by the write helpers and journal replay
+    def _apply_insert(self, record):
+        self._sorted = {}
+        existing = self._by_id.get(record['id'])
+        if existing is not None:
+            existing.clear()
+            existing.update(record)
+            return existing
+        if record['id'] < self._max_id:
+            self._in_id_order = False
+        self._records.append(record)
+        self._by_id[record['id']] = record
+        self._max_id = max(self._max_id, record['id'])
+        return record
+
+    def _apply_update(self, record_id, fields):
+        self._sorted = {}
+        record = self._by_id.get(record_id)
+        if record is not None:
+            record.update(fields)
+        return record
+
+    def _apply_delete(self, record_id):
+        if record_id not in self._by_id:
+            return False
+        self._sorted = {}
+        del self._by_id[record_id]
+        self._records = [r for r in self._records if r.get('id') != record_id]
+        if record_id == self._max_id:
+            self._max_id = max((r.get('id', 0) for r in self._records), default=0)
+        return True
+
+    # Read helpers hand out copies so callers can't corrupt the cache
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return [dict(r) for r in self._records]
+
+    def get(self, record_id):
+        with self._lock:
+            self._refresh()
+            record = self._by_id.get(record_id)
+            return dict(record) if record is not None else None
+
+    def get_many(self, record_ids):
+        with self._lock:
+            self._refresh()
+            return {i: dict(self._by_id[i]) for i in record_ids if i in self._by_id}
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    def _sorted_records(self, field):
+        # Records are normally appended in id order, so 'id' needs no
+        # sorting; other orderings are built once and kept until the data
+        # changes.
+        if field == 'id' and self._in_id_order:
+            return self._records
+        if field not in self._sorted:
+            key = (lambda r: r['id']) if field == 'id' else (lambda r: sort_key(r.get(field)))
+            self._sorted[field] = sorted(self._records, key=key)
+        return self._sorted[field]
+
+    def _id_range(self, rows, filters):
+        # Keyset pages: an id lower bound on id-ordered rows is found by
+        # binary search instead of testing every record before it
+        start = 0
+        for field, op, value in filters:
+            if field == 'id' and op in ('>', '>='):
+                find = bisect.bisect_right if op == '>' else bisect.bisect_left
+                start = max(start, find(rows, value, key=lambda r: r['id']))
+        return (rows[i] for i in range(start, len(rows)))
+
+    def query(self, filters=(), search=None, sort='id', offset=0, limit=None, count=True):
+        with self._lock:
+            self._refresh()
+            rows = self._sorted_records(sort.lstrip('-'))
+            end = None if limit is None else offset + limit
+            if not count:
+                rows = self._id_range(rows, filters) if sort == 'id' else reversed(rows) if sort.startswith('-') else rows
+                matches = (r for r in rows if record_matches(r, filters, search)) if filters or search else rows
+                return [dict(r) for r in itertools.islice(matches, offset, end)], None
+            if sort.startswith('-'):
+                rows = rows[::-1]
+            if filters or search:
+                rows = [r for r in rows if record_matches(r, filters, search)]
+            return [dict(r) for r in rows[offset:end]], len(rows)
+
+    def iter_batches(self, filters=(), batch_size=1000):
+        # Yields matching records in id order, a batch at a time, so large
+        # exports never hold a second full copy of the data.
+        with self._lock:
+            self._refresh()
+            rows = [r for r in self._sorted_records('id') if record_matches(r, filters)]
+        for start in range(0, len(rows), batch_size):
+            yield [dict(r) for r in rows[start:start + batch_size]]
+
+    def next_id(self):
+        with self._lock:
+            self._refresh()
+            return self._max_id + 1
+
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._version_token()
+
+    def snapshot(self):
+        # Version and records read together, for building derived indexes
+        with self._lock:
+            self._refresh()
+            return self._version_token(), [dict(r) for r in self._records]
+
+    # Write helpers; each is a transaction of its own unless nested
+    def save(self, records):
+        with self.transaction():
+            self._set_records([dict(r) for r in records])
+            self._changed('reset', None, None)
+
+    def insert(self, record):
+        with self.transaction():
+            record = dict(record)
+            if not record.get('id'):
+                record['id'] = self._max_id + 1
+            record = dict(self._apply_insert(record))
+            self._changed('insert', record, None, [{'op': 'insert', 'record': record}])
+            return dict(record)
+
+    def insert_many(self, records):
+        # ids are assigned as a contiguous range
+        with self.transaction():
+            records = [dict(r, id=self._max_id + i) for i, r in enumerate(records, 1)]
+            for record in records:
+                self._apply_insert(record)
+            records = [dict(r) for r in records]
+            self._changed('insert_many', records, None,
+                          [{'op': 'insert', 'record': r} for r in records])
+            return [dict(r) for r in records]
+
+    def update(self, record_id, fields):
+        with self.transaction():
+            old = self._by_id.get(record_id)
+            if old is None:
+                return None
+            old = dict(old)
+            record = dict(self._apply_update(record_id, fields))
+            self._changed('update', record, old, [{'op': 'update', 'id': record_id, 'fields': fields}])
+            return dict(record)
+
+    def update_many(self, changes):
+        # changes is a list of (record_id, fields)
+        with self.transaction():
+            changes = [(i, fields) for i, fields in changes if i in self._by_id]
+            olds = [dict(self._by_id[i]) for i, _ in changes]
+            records = [dict(self._apply_update(i, fields)) for i, fields in changes]
+            self._changed('update_many', records, olds,
+                          [{'op': 'update', 'id': i, 'fields': fields} for i, fields in changes])
+            return [dict(r) for r in records]
+
+    def delete(self, record_id):
+        with self.transaction():
+            old = self._by_id.get(record_id)
+            if old is None:
+                return False
+            old = dict(old)
+            self._apply_delete(record_id)
+            self._changed('delete', None, old, [{'op': 'delete', 'id': record_id}])
+            return True
+
+
+class JournaledJsonStore(JsonStore):
+    # Append-only variant for write-mostly data (deposits). Mutations are
+    # appended to a JSON-lines journal and fsynced, so their cost does not
+    # grow with the size of the snapshot file. Reads replay snapshot +
+    # journal, and compact() folds the journal back into the snapshot.
+    #
+    # Transactions buffer their journal lines and append them in one write
+    # on commit. Reloads take the lock file shared, so a reader never pairs
+    # an old snapshot with a journal that compaction has already reset.
+
+    def __init__(self, path, journal_path, compact_threshold=10000):
+        super().__init__(path)
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._compacting = False
+        self._lines = []
+        self._rewrite = False
+
+    def _journal_stat(self):
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            open(self.journal_path, 'a').close()
+            st = os.stat(self.journal_path)
+        return st.st_ino, st.st_size
+
+    def _refresh(self):
+        if self._depth:
+            return
+        with self._file_lock(fcntl.LOCK_SH):
+            self._refresh_locked()
+
+    def _version_token(self):
+        return f'{super()._version_token()}-{self._journal_ino}-{self._journal_offset}'
+
+    def _refresh_locked(self):
+        journal_ino, journal_size = self._journal_stat()
+        if (self._signature is None or self._file_signature() != self._signature
+                or journal_ino != self._journal_ino or journal_size < self._journal_offset):
+            self._load()
+            self._journal_ino = journal_ino
+            self._journal_offset = 0
+            self._journal_entries = 0
+        if journal_size > self._journal_offset:
+            self._replay()
+
+    def _replay(self):
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            data = f.read()
+        # A trailing line without a newline is a write still in progress
+        # (or torn by a crash); leave it for the next refresh.
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            op = entry.get('op')
+            if op == 'insert':
+                self._apply_insert(entry['record'])
+            elif op == 'update':
+                self._apply_update(entry['id'], entry['fields'])
+            elif op == 'delete':
+                self._apply_delete(entry['id'])
+            self._journal_entries += 1
+        self._journal_offset += end
+
+    def _changed(self, op, record, old, entries=()):
+        super()._changed(op, record, old, entries)
+        # Serialised now, so callers changing the returned records before
+        # the transaction ends can't alter what gets logged
+        self._lines.extend(json.dumps(entry) + '\n' for entry in entries)
+
+    def _commit(self):
+        if self._rewrite:
+            # The snapshot already holds every change, journal lines included
+            self._write_snapshot()
+        elif self._lines:
+            self._append(self._lines)
+        self._lines, self._rewrite = [], False
+
+    def _rollback(self):
+        if self._dirty or self._lines or self._rewrite:
+            self._journal_ino = None
+        super()._rollback()
+        self._lines, self._rewrite = [], False
+
+    def _append(self, lines):
+        # Caller holds the exclusive lock and has just refreshed, so anything
+        # past our offset is a torn line left by a crashed writer.
+        if self._journal_stat()[1] > self._journal_offset:
+            os.truncate(self.journal_path, self._journal_offset)
+        data = ''.join(lines).encode()
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._journal_offset += len(data)
+        self._journal_entries += len(lines)
+        if self._journal_entries >= self.compact_threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._background_compact, daemon=True).start()
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self):
+        # Write-temp + rename so readers never see a half-written snapshot
+        atomic_write_json(self.path, self._records)
+        self._reset_journal()
+
+    def compact(self):
+        # The new snapshot is written from a copy of the records without the
+        # write lock, so readers in other workers aren't held up while it is
+        # serialised and fsynced. The exclusive lock is only taken to swap it
+        # in, carrying over journal lines appended in the meantime. Replaying
+        # the journal is idempotent, so a crash between replacing the
+        # snapshot and resetting the journal loses nothing.
+        with self._lock:
+            self._refresh()
+            folded = self._journal_entries
+            if not folded:
+                return 0
+            records = [dict(r) for r in self._records]
+            signature, journal_ino, offset = self._signature, self._journal_ino, self._journal_offset
+        tmp_path = _write_temp_json(self.path, records)
+        try:
+            with self.transaction():
+                if ((self._signature, self._journal_ino) != (signature, journal_ino)
+                        or self._journal_offset < offset):
+                    # Another worker compacted or saved first
+                    return 0
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read(self._journal_offset - offset)
+                os.replace(tmp_path, self.path)
+                self._reset_journal(tail)
+                return folded
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _reset_journal(self, data=b''):
+        # Caller holds the exclusive lock and has just replaced the snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.journal_path) or '.', prefix='.tmp-')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._signature = self._file_signature()
+        self._journal_ino, self._journal_offset = self._journal_stat()
+        self._journal_entries = data.count(b'\n')
+
+    def save(self, records):
+        with self.transaction():
+            super().save(records)
+            self._rewrite = True
+
+
+# One connection per database file per thread, shared by the stores of
+# every table in it, along with the changes of its open transaction
+_sqlite_local = threading.local()
+
+
+class SqliteStore:
+    # One table per store: the full record is kept as JSON in `data`, while
+    # the id and any lookup columns are real columns so they can be indexed.
+    # Single-row mutations touch only that row instead of rewriting a file.
+
+    def __init__(self, path, table, indexed=()):
+        self.path = path
+        self.table = table
+        self.indexed = list(indexed)
+        self.lock_stats = LockStats()
+        self._listeners = []
+        self._create_schema()
+
+    def _connect(self):
+        conns = _sqlite_local.__dict__.setdefault('conns', {})
+        conn = conns.get(self.path)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conns[self.path] = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        columns = ''.join(f', "{col}"' for col in self.indexed)
+        with conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                         f'(id INTEGER PRIMARY KEY{columns}, data TEXT NOT NULL)')
+            for col in self.indexed:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_{col} '
+                             f'ON {self.table} ("{col}")')
+            conn.execute('CREATE TABLE IF NOT EXISTS store_versions '
+                         '(name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO store_versions VALUES (?, 0)', (self.table,))
+
+    def _bump_version(self, conn):
+        # Called after the row change, inside the same write transaction
+        conn.execute('UPDATE store_versions SET version = version + 1 WHERE name = ?',
+                     (self.table,))
+        version = conn.execute('SELECT version FROM store_versions WHERE name = ?',
+                               (self.table,)).fetchone()[0]
+        return str(version - 1), str(version)
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the database write lock up front, so reads
+        # inside the block see the rows the writes will apply to. Nested
+        # calls, from this or another table on the same database, join the
+        # open transaction; listeners hear about its changes once it commits.
+        conn = self._connect()
+        pending = _sqlite_local.__dict__.setdefault('pending', {})
+        if self.path in pending:
+            yield self
+            return
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        self.lock_stats.record(time.perf_counter() - started)
+        pending[self.path] = []
+        try:
+            yield self
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            changes = pending.pop(self.path)
+        for listeners, change in changes:
+            for callback in listeners:
+                callback(*change)
+
+    def _changed(self, op, record, old, previous, version):
+        _sqlite_local.pending[self.path].append((self._listeners, (op, record, old, previous, version)))
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def version(self):
+        row = self._connect().execute('SELECT version FROM store_versions WHERE name = ?',
+                                      (self.table,)).fetchone()
+        return str(row[0]) if row else '0'
+
+    def snapshot(self):
+        return self.version(), self.all()
+
+    def _row_values(self, record):
+        data = {k: v for k, v in record.items() if k != 'id'}
+        return [record.get(col) for col in self.indexed] + [json.dumps(data)]
+
+    def _to_record(self, row):
+        record = {'id': row[0]}
+        record.update(json.loads(row[1]))
+        return record
+
+    def _insert_sql(self):
+        columns = ''.join(f', "{col}"' for col in self.indexed)
+        placeholders = ', ?' * (len(self.indexed) + 1)
+        return f'INSERT INTO {self.table} (id{columns}, data) VALUES (?{placeholders})'
+
+    def all(self):
+        rows = self._connect().execute(f'SELECT id, data FROM {self.table} ORDER BY id')
+        return [self._to_record(row) for row in rows]
+
+    def get(self, record_id):
+        row = self._connect().execute(
+            f'SELECT id, data FROM {self.table} WHERE id = ?', (record_id,)).fetchone()
+        return self._to_record(row) if row else None
+
+    def get_many(self, record_ids):
+        record_ids = list(record_ids)
+        if not record_ids:
+            return {}
+        placeholders = ', '.join('?' * len(record_ids))
+        rows = self._connect().execute(
+            f'SELECT id, data FROM {self.table} WHERE id IN ({placeholders})', record_ids)
+        return {row[0]: self._to_record(row) for row in rows}
+
+    def count(self):
+        return self._connect().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def _column(self, field):
+        if field == 'id' or field in self.indexed:
+            return f'"{field}"'
+        return f"json_extract(data, '$.{field}')"
+
+    def _where(self, filters=(), search=None):
+        clauses, params = [], []
+        for field, op, value in filters:
+            if op == 'in':
+                value = list(value)
+                if not value:
+                    clauses.append('0')
+                    continue
+                clauses.append(f'{self._column(field)} IN ({", ".join("?" * len(value))})')
+                params.extend(value)
+            else:
+                clauses.append(f'{self._column(field)} {"=" if op == "==" else op} ?')
+                params.append(value)
+        if search:
+            fields, text = search
+            # A plain substring match, like record_matches(): % and _ are literal
+            pattern = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append('(' + ' OR '.join(
+                f"lower({self._column(f)}) LIKE ? ESCAPE '\\'" for f in fields) + ')')
+            params.extend([f'%{pattern}%'] * len(fields))
+        return clauses, params
+
+    def query(self, filters=(), search=None, sort='id', offset=0, limit=None, count=True):
+        clauses, params = self._where(filters, search)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+        conn = self._connect()
+        total = None
+        if count:
+            total = conn.execute(f'SELECT COUNT(*) FROM {self.table}{where}', params).fetchone()[0]
+        direction = 'DESC' if sort.startswith('-') else 'ASC'
+        sql = (f'SELECT id, data FROM {self.table}{where} '
+               f'ORDER BY {self._column(sort.lstrip("-"))} {direction}, id {direction}')
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params = params + [limit, offset]
+        return [self._to_record(row) for row in conn.execute(sql, params)], total
+
+    def iter_batches(self, filters=(), batch_size=1000):
+        # Keyset pagination on the primary key keeps every batch O(log n)
+        clauses, params = self._where(filters)
+        last_id = 0
+        while True:
+            where = ' AND '.join(clauses + ['id > ?'])
+            rows = self._connect().execute(
+                f'SELECT id, data FROM {self.table} WHERE {where} ORDER BY id LIMIT ?',
+                params + [last_id, batch_size]).fetchall()
+            if not rows:
+                return
+            yield [self._to_record(row) for row in rows]
+            last_id = rows[-1][0]
+
+    def next_id(self):
+        row = self._connect().execute(f'SELECT MAX(id) FROM {self.table}').fetchone()
+        return (row[0] or 0) + 1
+
+    def save(self, records):
+        conn = self._connect()
+        with self.transaction():
+            conn.execute(f'DELETE FROM {self.table}')
+            conn.executemany(self._insert_sql(),
+                             ([r.get('id')] + self._row_values(r) for r in records))
+            previous, version = self._bump_version(conn)
+            self._changed('reset', None, None, previous, version)
+
+    def insert(self, record):
+        conn = self._connect()
+        with self.transaction():
+            cursor = conn.execute(self._insert_sql(),
+                                  [record.get('id') or None] + self._row_values(record))
+            previous, version = self._bump_version(conn)
+            record = dict(record)
+            record['id'] = cursor.lastrowid
+            self._changed('insert', record, None, previous, version)
+            return record
+
+    def insert_many(self, records):
+        conn = self._connect()
+        with self.transaction():
+            # The transaction holds the write lock, so the id range is ours
+            start = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {self.table}').fetchone()[0]
+            records = [dict(r, id=start + i) for i, r in enumerate(records, 1)]
+            conn.executemany(self._insert_sql(),
+                             ([r['id']] + self._row_values(r) for r in records))
+            previous, version = self._bump_version(conn)
+            self._changed('insert_many', records, None, previous, version)
+            return records
+
+    def update(self, record_id, fields):
+        conn = self._connect()
+        with self.transaction():
+            row = conn.execute(f'SELECT id, data FROM {self.table} WHERE id = ?',
+                               (record_id,)).fetchone()
+            if row is None:
+                return None
+            old = self._to_record(row)
+            record = dict(old, **fields)
+            assignments = ''.join(f'"{col}" = ?, ' for col in self.indexed)
+            conn.execute(f'UPDATE {self.table} SET {assignments}data = ? WHERE id = ?',
+                         self._row_values(record) + [record_id])
+            previous, version = self._bump_version(conn)
+            self._changed('update', record, old, previous, version)
+            return record
+
+    def update_many(self, changes):
+        conn = self._connect()
+        assignments = ''.join(f'"{col}" = ?, ' for col in self.indexed)
+        records, olds = [], []
+        with self.transaction():
+            for record_id, fields in changes:
+                row = conn.execute(f'SELECT id, data FROM {self.table} WHERE id = ?',
+                                   (record_id,)).fetchone()
+                if row is None:
+                    continue
+                old = self._to_record(row)
+                record = dict(old, **fields)
+                conn.execute(f'UPDATE {self.table} SET {assignments}data = ? WHERE id = ?',
+                             self._row_values(record) + [record_id])
+                olds.append(old)
+                records.append(record)
+            previous, version = self._bump_version(conn)
+            self._changed('update_many', records, olds, previous, version)
+            return records
+
+    def delete(self, record_id):
+        conn = self._connect()
+        with self.transaction():
+            row = conn.execute(f'SELECT id, data FROM {self.table} WHERE id = ?',
+                               (record_id,)).fetchone()
+            if row is None:
+                return False
+            conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (record_id,))
+            previous, version = self._bump_version(conn)
+            self._changed('delete', None, self._to_record(row), previous, version)
+            return True
+
+    def import_json(self, json_path):
+        # One-shot migration: only runs while the table is still empty
+        with self.transaction():
+            if self.count() or not os.path.exists(json_path):
+                return 0
+            with open(json_path, 'r') as f:
+                records = json.load(f)
+            self.save(records)
+            return len(records)
+
+
+class StoreIndex:
+    # Base class for in-memory structures derived from a store (search
+    # index, aggregates, rollups). Local writes are applied incrementally
+    # through the store's change listeners; if the store changed behind our
+    # back (another worker), the next sync() rebuilds from a snapshot.
+    # Subclasses implement rebuild(records) and apply(op, record, old).
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.RLock()
+        self._version = None
+        self._stale = False
+        store.subscribe(self._on_change)
+
+    def _on_change(self, op, record, old, previous, version):
+        with self._lock:
+            if self._version is None or op == 'reset' or previous != self._version:
+                self._version = None
+                return
+            if op == 'insert_many':
+                for item in record:
+                    self.apply('insert', item, None)
+            elif op == 'update_many':
+                for item, old_item in zip(record, old):
+                    self.apply('update', item, old_item)
+            else:
+                self.apply(op, record, old)
+            self._version = version
+
+    def invalidate(self):
+        # For apply() when a change can't be handled incrementally
+        self._stale = True
+
+    def sync(self):
+        if not self._stale and self._version is not None and self._version == self.store.version():
+            return
+        version, records = self.store.snapshot()
+        with self._lock:
+            self._stale = False
+            self.rebuild(records)
+            self._version = version
+
+    def rebuild(self, records):
+        raise NotImplementedError
+
+    def apply(self, op, record, old):
+        raise NotImplementedError
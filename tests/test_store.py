@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from ledger import DepositLedger
+from store import JsonStore, JournaledJsonStore, SqliteStore
+
+
+def make_store(kind, tmp_path, name='deposits'):
+    if kind == 'json':
+        return JsonStore(str(tmp_path / f'{name}.json'))
+    if kind == 'journal':
+        return JournaledJsonStore(str(tmp_path / f'{name}.json'), str(tmp_path / f'{name}.jsonl'),
+                                  compact_threshold=10 ** 9)
+    return SqliteStore(str(tmp_path / 'test.db'), name, indexed=['customer_id', 'date'])
+
+
+BACKENDS = ['json', 'journal', 'sqlite']
+
+DEPOSITS = [
+    {'customer_id': 1 + i % 4, 'amount': float(10 + i * 7 % 50), 'date': f'2024-0{1 + i % 3}-{10 + i % 9:02d}',
+     'notes': f'note {i}'}
+    for i in range(40)
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path):
+    return make_store(request.param, tmp_path)
+
+
+def test_rollback_leaves_store_unchanged(store):
+    store.insert_many(DEPOSITS[:5])
+    before, version = store.all(), store.version()
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.insert(DEPOSITS[5])
+            store.update(1, {'amount': -1.0})
+            store.delete(2)
+            raise RuntimeError('abort')
+    assert store.all() == before
+    assert store.version() == version
+
+
+def test_nested_transactions_commit_once(store):
+    events = []
+    store.subscribe(lambda op, record, old, previous, version: events.append(op))
+    with store.transaction():
+        store.insert(DEPOSITS[0])
+        with store.transaction():
+            store.insert(DEPOSITS[1])
+        assert events == []
+    assert events == ['insert', 'insert']
+    assert store.count() == 2
+
+
+def test_write_is_seen_by_another_instance(store, tmp_path):
+    kind = {JsonStore: 'json', JournaledJsonStore: 'journal', SqliteStore: 'sqlite'}[type(store)]
+    other = make_store(kind, tmp_path)
+    store.insert_many(DEPOSITS[:3])
+    assert other.count() == 3
+    version = other.version()
+    store.update(2, {'notes': 'changed'})
+    assert other.version() != version
+    assert other.get(2)['notes'] == 'changed'
+    other.delete(1)
+    assert store.get(1) is None
+
+
+def test_journal_replay_ignores_partial_line(tmp_path):
+    store = make_store('journal', tmp_path)
+    store.insert_many(DEPOSITS[:3])
+    store.update(1, {'amount': 99.0})
+    with open(store.journal_path, 'a') as f:
+        f.write(json.dumps({'op': 'delete', 'id': 2})[:10])
+    reader = make_store('journal', tmp_path)
+    assert [r['id'] for r in reader.all()] == [1, 2, 3]
+    assert reader.get(1)['amount'] == 99.0
+    # The next write replaces the torn line instead of appending after it
+    reader.insert(DEPOSITS[3])
+    assert [r['id'] for r in make_store('journal', tmp_path).all()] == [1, 2, 3, 4]
+
+
+def test_compact_twice_gives_same_result(tmp_path):
+    store = make_store('journal', tmp_path)
+    store.insert_many(DEPOSITS[:10])
+    store.update(3, {'amount': 1.5})
+    store.delete(4)
+    expected = store.all()
+    assert store.compact() > 0
+    with open(store.path) as f:
+        snapshot = f.read()
+    assert store.compact() == 0
+    with open(store.path) as f:
+        assert f.read() == snapshot
+    assert store.all() == expected
+    assert make_store('journal', tmp_path).all() == expected
+    store.insert(DEPOSITS[10])
+    assert make_store('journal', tmp_path).count() == len(expected) + 1
+
+
+@pytest.mark.parametrize('filters,sort', [
+    ([], 'id'),
+    ([('customer_id', '==', 2)], 'id'),
+    ([('amount', '>=', 30.0), ('amount', '<=', 45.0)], '-amount'),
+    ([('date', '>=', '2024-02-01'), ('date', '<=', '2024-02-28')], 'date'),
+    ([('customer_id', 'in', [1, 3])], '-date'),
+    ([('id', '>', 25)], 'id'),
+])
+def test_query_backends_agree(tmp_path, filters, sort):
+    json_store = make_store('json', tmp_path)
+    sqlite_store = make_store('sqlite', tmp_path)
+    for s in (json_store, sqlite_store):
+        s.insert_many(DEPOSITS)
+    ledger = DepositLedger(json_store)
+    assert ledger.supports(filters, sort)
+    expected, total = json_store.query(filters, sort=sort, offset=2, limit=7)
+    assert sqlite_store.query(filters, sort=sort, offset=2, limit=7) == (expected, total)
+    rows, ledger_total = ledger.query(filters, sort=sort, offset=2, limit=7)
+    assert ledger_total == total
+    assert [r['id'] for r in rows] == [r['id'] for r in expected]
+    assert json_store.query(filters, sort=sort, offset=2, limit=7, count=False) == (expected, None)
+
+
+def test_search_is_a_plain_substring_match(tmp_path):
+    names = ['Ann', 'B_b', '50% off', 'Bob']
+    for kind in ('json', 'sqlite'):
+        s = make_store(kind, tmp_path, 'customers')
+        s.insert_many({'name': n} for n in names)
+        for text, found in [('_', ['B_b']), ('%', ['50% off']), ('b', ['B_b', 'Bob'])]:
+            rows, _ = s.query(search=(['name'], text))
+            assert [r['name'] for r in rows] == found
+
+
+def test_sort_mixed_types(tmp_path):
+    s = make_store('json', tmp_path, 'customers')
+    s.insert_many([{'phone': '555'}, {'phone': 123}, {'phone': None}, {'phone': float('nan')}])
+    assert [r['phone'] for r in s.query(sort='phone')[0]][:2] == [123, '555']